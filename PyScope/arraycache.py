@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+
+import warnings
+with warnings.catch_warnings():  # pypy's experimental version of numpy always screams at you
+    warnings.simplefilter("ignore")
+    import numpy as np
+
+MAGIC = "PYSCOPE-CACHE-1\n"
+ALIGN = 64
+
+
+def cachePath(filename):
+    """The compiled sidecar file that sits next to a source file."""
+    return filename + ".cache"
+
+def sourceKey(filename):
+    """Identify a source file by its path, size, modification time and content hash."""
+    stat = os.stat(filename)
+    digest = hashlib.sha1()
+    with open(filename, "rb") as source:
+        for block in iter(lambda: source.read(1 << 20), b""):
+            digest.update(block)
+    return {"path": os.path.abspath(filename), "size": stat.st_size, "mtime": stat.st_mtime,
+            "sha1": digest.hexdigest()}
+
+def save(filename, arrays, key=None):
+    """Write a dict of arrays to the sidecar of filename.
+
+    The file holds a JSON header followed by each array's raw data, aligned so they can be memory-mapped."""
+    if key is None:
+        key = sourceKey(filename)
+    layout = {}
+    offset = 0
+    for name, array in sorted(arrays.items()):
+        offset = (offset + ALIGN - 1) // ALIGN * ALIGN
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += array.nbytes
+    header = json.dumps({"key": key, "arrays": layout})
+    start = (len(MAGIC) + 8 + len(header) + ALIGN - 1) // ALIGN * ALIGN
+
+    path = cachePath(filename)
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(temp_path, "wb") as out:
+        out.write(MAGIC)
+        out.write("%08d" % len(header))
+        out.write(header)
+        for name, array in sorted(arrays.items()):
+            out.seek(start + layout[name]["offset"])
+            out.write(np.ascontiguousarray(array).tostring())
+    # Another process may have written (or still have mapped) the same cache; either copy is fine
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(temp_path, path)
+    except OSError:
+        os.remove(temp_path)
+
+def load(filename, key=None):
+    """Memory-map the arrays in the sidecar of filename, or return None if it is missing or out of date.
+
+    Arrays are mapped copy-on-write, so processes loading the same cache share its pages."""
+    path = cachePath(filename)
+    if not os.path.exists(path):
+        return None
+    if key is None:
+        key = sourceKey(filename)
+    try:
+        with open(path, "rb") as cache:
+            if cache.read(len(MAGIC)) != MAGIC:
+                return None
+            header_length = int(cache.read(8))
+            header = json.loads(cache.read(header_length))
+    except (IOError, ValueError):
+        return None
+    if header["key"] != key:
+        return None
+    start = (len(MAGIC) + 8 + header_length + ALIGN - 1) // ALIGN * ALIGN
+    arrays = {}
+    for name, info in header["arrays"].items():
+        shape = tuple(info["shape"])
+        if 0 in shape:
+            arrays[name] = np.zeros(shape, dtype=info["dtype"])
+        else:
+            arrays[name] = np.memmap(path, dtype=info["dtype"], mode="c", offset=start + info["offset"], shape=shape)
+    return arrays
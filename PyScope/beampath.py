@@ -0,0 +1,263 @@
+import collections
+import timeit
+
+import warnings
+with warnings.catch_warnings():  # pypy's experimental version of numpy always screams at you
+    warnings.simplefilter("ignore")
+    import numpy as np
+
+
+def jump_distance(vecs):
+    """Total distance the beam travels between the end of each vector and the start of the next."""
+    if len(vecs) < 2:
+        return 0.0
+    return float(np.sqrt(((vecs[1:, 0] - vecs[:-1, 1]) ** 2).sum(axis=1)).sum())
+
+def describe(totals):
+    """One line on the frames planned, from the totals of BeamPathPlanner.take, added up across planners if need be."""
+    frames = max(totals["frames"], 1)
+    return "Beam path: %d frames planned, %.1f mean jump distance, %.2f ms mean planning time per frame" % \
+        (totals["frames"], totals["jump_distance"] / frames, 1000.0 * totals["plan_time"] / frames)
+
+def topology(vecs, decimals=3):
+    """Label the endpoints of an (E, 2, 2) vector array by shared position.
+
+    Returns an (E, 2) array of vertex ids numbered in order of first appearance,
+    so two frames with the same connectivity get identical labels."""
+    points = np.round(vecs.reshape(-1, 2), decimals)
+    _, first, inverse = np.unique(points.view([('', points.dtype)] * 2).reshape(-1), return_index=True,
+                                  return_inverse=True)
+    relabel = np.empty(len(first), dtype=np.int64)
+    relabel[np.argsort(first, kind="mergesort")] = np.arange(len(first))
+    return relabel[inverse].reshape(-1, 2)
+
+def euler_trails(ends, num_vertices):
+    """Split an edge graph into as few trails as possible.
+
+    Odd-degree vertices are paired, in order of their labels, by virtual edges so that every vertex
+    has even degree, an Euler circuit is walked over each component (Hierholzer's algorithm) and the
+    circuits are cut wherever they cross a virtual edge. No positions are used, so the trails depend
+    on nothing but the topology. Returns a list of trails, each a list of (edge, flipped) pairs, and
+    whether each trail is a closed loop."""
+    num_edges = len(ends)
+    degree = np.bincount(ends.reshape(-1), minlength=num_vertices)
+    odd = np.flatnonzero(degree % 2).tolist()
+    pairs = zip(odd[0::2], odd[1::2])
+    all_ends = [tuple(e) for e in ends.tolist()] + pairs
+    adjacent = [[] for _ in xrange(num_vertices)]
+    for e, (a, b) in enumerate(all_ends):
+        adjacent[a].append(e)
+        adjacent[b].append(e)
+
+    used = [False] * len(all_ends)
+    pointer = [0] * num_vertices
+    trails = []
+    closed = []
+    for start in xrange(num_vertices):
+        if pointer[start] >= len(adjacent[start]):
+            continue
+        stack = [(start, None)]
+        circuit = []
+        while stack:
+            v, arrived_by = stack[-1]
+            edges_here = adjacent[v]
+            while pointer[v] < len(edges_here) and used[edges_here[pointer[v]]]:
+                pointer[v] += 1
+            if pointer[v] < len(edges_here):
+                e = edges_here[pointer[v]]
+                used[e] = True
+                a, b = all_ends[e]
+                stack.append((b if a == v else a, (e, a != v)))
+            else:
+                stack.pop()
+                if arrived_by is not None:
+                    circuit.append(arrived_by)
+        if not circuit:
+            continue
+        circuit.reverse()
+        cuts = [i for i, step in enumerate(circuit) if step[0] >= num_edges]
+        if not cuts:
+            trails.append(circuit)
+            closed.append(True)
+            continue
+        # rotate so the circuit begins just after a virtual edge, then split at each virtual edge
+        circuit = circuit[cuts[0] + 1:] + circuit[:cuts[0] + 1]
+        trail = []
+        for e, flipped in circuit:
+            if e >= num_edges:
+                if trail:
+                    trails.append(trail)
+                    closed.append(False)
+                trail = []
+            else:
+                trail.append((e, flipped))
+        if trail:
+            trails.append(trail)
+            closed.append(False)
+    return trails, closed
+
+
+class BeamPathPlanner:
+    """Orders a frame's vectors so that the beam spends as little of the frame as possible jumping between them.
+
+    Connected vectors are chained into trails over their shared endpoints and the trails are then
+    ordered by "greedy" nearest-neighbour search, optionally improved by "2opt". The "midpoint"
+    method is the old behaviour of sorting vectors by their midpoints. The trails are cached by topology,
+    since a wireframe's edge graph stays the same from frame to frame, with the least recently used
+    evicted first. Their order is worked out afresh from each frame's positions, so a frame is always
+    planned the same way whatever was planned before it."""
+
+    def __init__(self, method="greedy", max_cached=64, max_2opt_trails=400):
+        if method not in ("midpoint", "greedy", "2opt"):
+            raise Exception("Invalid path planning method. Valid methods are midpoint, greedy and 2opt.")
+        self.method = method
+        self.max_cached = max_cached
+        self.max_2opt_trails = max_2opt_trails
+        self.plans = collections.OrderedDict()
+
+        self.last_jump_distance = 0.0
+        self.last_plan_time = 0.0
+        self.last_cached = False
+        self.total_jump_distance = 0.0
+        self.total_plan_time = 0.0
+        self.frames = 0
+
+    def take(self):
+        """Hand over the totals so far, as a dict of frames, jump_distance and plan_time, and start afresh."""
+        totals = {"frames": self.frames, "jump_distance": self.total_jump_distance, "plan_time": self.total_plan_time}
+        self.frames = 0
+        self.total_jump_distance = 0.0
+        self.total_plan_time = 0.0
+        return totals
+
+    def plan(self, vecs):
+        """Return the (E, 2, 2) vector array reordered, and flipped where it helps."""
+        start = timeit.default_timer()
+        vecs = np.asarray(vecs, dtype=np.float64).reshape(-1, 2, 2)
+        self.last_cached = False
+        if len(vecs) < 2:
+            ordered = vecs
+        elif self.method == "midpoint":
+            mids = vecs.sum(axis=1) / 2
+            ordered = vecs[np.lexsort((mids[:, 1], mids[:, 0]))]
+        else:
+            ends = topology(vecs)
+            key = (len(vecs), ends.tostring())
+            trails = self.plans.pop(key, None)
+            if trails is not None:
+                self.last_cached = True
+            else:
+                trails = self.build_trails(ends)
+                if len(self.plans) >= self.max_cached:
+                    self.plans.popitem(last=False)
+            self.plans[key] = trails
+            order, flips = self.build_plan(vecs, ends, trails)
+            ordered = vecs[order]
+            ordered[flips] = ordered[flips, ::-1]
+
+        self.last_plan_time = timeit.default_timer() - start
+        self.last_jump_distance = jump_distance(ordered)
+        self.total_plan_time += self.last_plan_time
+        self.total_jump_distance += self.last_jump_distance
+        self.frames += 1
+        return ordered
+
+    def build_trails(self, ends):
+        """The part of a plan that depends only on topology: the trails, and every way of entering them.
+
+        Open trails may be entered from either end; closed loops may be entered at any vertex.
+        Returns the trails, an (N, 3) array of (trail, position to start from, reversed) entries
+        and the vertex each entry starts at."""
+        trails, closed = euler_trails(ends, ends.max() + 1)
+        entries = []
+        for t, trail in enumerate(trails):
+            if closed[t]:
+                entries.extend((t, i, False) for i in xrange(len(trail)))
+            else:
+                entries.append((t, 0, False))
+                entries.append((t, 0, True))
+        entries = np.array(entries, dtype=np.int64).reshape(-1, 3)
+        entry_vertices = np.array([self.trail_start(trails[t], i, r, ends) for t, i, r in entries], dtype=np.int64)
+        return trails, entries, entry_vertices
+
+    def build_plan(self, vecs, ends, trails):
+        """Order a frame's trails by its positions. Returns edge order and per-edge flip flags."""
+        points = np.zeros((ends.max() + 1, 2))
+        points[ends.reshape(-1)] = vecs.reshape(-1, 2)
+        trails = self.order_trails(trails, ends, points)
+        if self.method == "2opt":
+            trails = self.two_opt(trails, ends, points)
+        order = np.array([e for trail in trails for e, _ in trail], dtype=np.int64)
+        flips = np.array([flipped for trail in trails for _, flipped in trail], dtype=bool)
+        return order, flips
+
+    def order_trails(self, trails, ends, points):
+        """Greedy nearest-neighbour ordering of the trails from build_trails."""
+        trails, entries, entry_vertices = trails
+        entry_points = points[entry_vertices]
+        alive = np.ones(len(entries), dtype=bool)
+        entry_trail = entries[:, 0]
+
+        result = []
+        position = points[self.trail_start(trails[0], 0, False, ends)]
+        for _ in xrange(len(trails)):
+            dists = ((entry_points - position) ** 2).sum(axis=1)
+            dists[~alive] = np.inf
+            t, i, r = entries[int(np.argmin(dists))]
+            alive[entry_trail == t] = False
+            trail = trails[t][i:] + trails[t][:i]
+            if r:
+                trail = [(e, not flipped) for e, flipped in reversed(trail)]
+            result.append(trail)
+            position = points[self.trail_end(trail, ends)]
+        return result
+
+    def two_opt(self, trails, ends, points):
+        """Improve the trail order by reversing runs of trails while that shortens the jumps.
+
+        After the first pass over the trails, only those next to a reversal are looked at again."""
+        count = len(trails)
+        if count < 3 or count > self.max_2opt_trails:
+            return trails
+        starts = np.array([points[self.trail_start(trail, 0, False, ends)] for trail in trails])
+        finishes = np.array([points[self.trail_end(trail, ends)] for trail in trails])
+        look = [True] * count
+        improved = True
+        while improved:
+            improved = False
+            for i in xrange(count - 2):
+                if not look[i]:
+                    continue
+                look[i] = False
+                # reversing trails i+1..j replaces jumps end_i->start_i+1 and end_j->start_j+1
+                # with end_i->end_j and start_i+1->start_j+1
+                j = np.arange(i + 1, count)
+                nxt = np.minimum(j + 1, count - 1)
+                has_next = j + 1 < count
+                old = np.hypot(*(finishes[i] - starts[i + 1])) + \
+                    np.where(has_next, np.hypot(*(finishes[j] - starts[nxt]).T), 0)
+                new = np.hypot(*(finishes[i] - finishes[j]).T) + \
+                    np.where(has_next, np.hypot(*(starts[i + 1] - starts[nxt]).T), 0)
+                gain = old - new
+                best = int(np.argmax(gain))
+                if gain[best] > 1e-9:
+                    j = int(j[best])
+                    trails[i + 1:j + 1] = [[(e, not flipped) for e, flipped in reversed(trail)]
+                                           for trail in reversed(trails[i + 1:j + 1])]
+                    starts[i + 1:j + 1], finishes[i + 1:j + 1] = finishes[j:i:-1].copy(), starts[j:i:-1].copy()
+                    for k in (i - 1, i, i + 1, j - 1, j, j + 1):
+                        if 0 <= k < count:
+                            look[k] = True
+                    improved = True
+        return trails
+
+    def trail_start(self, trail, position, reverse, ends):
+        if reverse:
+            e, flipped = trail[position - 1]
+            return ends[e][0] if flipped else ends[e][1]
+        e, flipped = trail[position]
+        return ends[e][1] if flipped else ends[e][0]
+
+    def trail_end(self, trail, ends):
+        e, flipped = trail[-1]
+        return ends[e][0] if flipped else ends[e][1]
@@ -0,0 +1,273 @@
+import wireframeDisplay as wd
+import basicShapes as shape
+import wavoutput as wav
+import wireframe as wf
+import objparser as obj
+import pyscope
+
+import multiprocessing
+import subprocess
+import resource
+import argparse
+import tempfile
+import hashlib
+import timeit
+import json
+import sys
+import os
+
+import warnings
+with warnings.catch_warnings():  # pypy's experimental version of numpy always screams at you
+    warnings.simplefilter("ignore")
+    import numpy as np
+
+
+def capture_frames(wireframe, frames=30, size=800):
+    """Spin a wireframe and return each frame's edge lengths, as wavify would see them."""
+    viewer = wd.WireframeViewer(size, show_view=False)
+    viewer.addWireframe('spin', wireframe)
+    viewer.centerWireframe('spin')
+    wavout = wav.WavOutput(os.path.join(tempfile.gettempdir(), "benchmark.raw"), 60)
+    result = []
+    for _ in xrange(frames):
+        viewer.display()
+        vecs = list(wavout.valid_vecs(viewer.frame_edges, size))
+        result.append([wavout.distance(vec[0], vec[1]) for vec in vecs])
+        center = viewer.wireframes['spin'].findCenter()
+        viewer.wireframes['spin'].transform(wf.rotateAboutVector(center, (0,1,0), np.pi / frames))
+    wavout.buffer_wav(None)
+    return result
+
+def bench_allocators(frames, budgets, allocators):
+    """Time each allocator over the captured frames, and count the samples it leaves unused."""
+    for budget in budgets:
+        print "Budget: %d samples per frame" % budget
+        for name, allocator in allocators:
+            start = timeit.default_timer()
+            padding = 0
+            for lengths in frames:
+                padding += budget - int(allocator(lengths, budget).sum())
+            elapsed = timeit.default_timer() - start
+            print "   %-12s %8.3f ms/frame %8.1f padding samples/frame" % \
+                (name, 1000.0 * elapsed / len(frames), float(padding) / len(frames))
+
+def bench_mesh_cache(filenames, repeats=5):
+    """Compare loading each OBJ file from its compiled cache against parsing it from scratch."""
+    for filename in filenames:
+        start = timeit.default_timer()
+        for _ in xrange(repeats):
+            obj.loadOBJ(filename, use_cache=False)
+        cold = (timeit.default_timer() - start) / repeats
+        obj.loadOBJ(filename)  # make sure the cache exists
+        start = timeit.default_timer()
+        for _ in xrange(repeats):
+            obj.loadOBJ(filename)
+        hit = (timeit.default_timer() - start) / repeats
+        print "   %-16s cold parse %8.2f ms   cache hit %8.2f ms   (%.1fx)" % \
+            (filename, 1000.0 * cold, 1000.0 * hit, cold / hit)
+
+def bench_scene(scene, mode, frames, fps, workers, load_repeats=5):
+    """Render frames of a pyscope scene at a fixed fps, single-process or on the parallel path, and measure it.
+
+    Meant to run in a process of its own (see bench_scenes) so that its peak RSS is its own. The result
+    includes a digest of the output, so that the two modes can be checked against each other.
+
+    largest_rss_kb is the peak RSS of the largest single process: this one, or on the parallel path the
+    largest pool worker. It is not the total, which with w workers can be up to w + 1 times as much."""
+    pyscope.scene = scene
+    pyscope.fixed_fps = fps
+    pyscope.spin_times = frames * pyscope.spin_speed / float(fps)
+    pyscope.num_workers = workers
+    filename = os.path.join(tempfile.gettempdir(), "benchmark-%s-%s-%d.wav" % (scene, mode, os.getpid()))
+    real_stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        viewer = wd.WireframeViewer(800, show_view=False)
+        pyscope.setup_viewer(viewer)  # compiles any mesh cache, so the timed loads below are warm ones
+        load_times = []
+        for _ in xrange(load_repeats):
+            # the best of several, as one load of a small scene takes well under a millisecond
+            start = timeit.default_timer()
+            viewer = wd.WireframeViewer(800, show_view=False)
+            pyscope.setup_viewer(viewer)
+            load_times.append(timeit.default_timer() - start)
+        load_time = min(load_times)
+        timeline = pyscope.get_timeline()
+        start = timeit.default_timer()
+        if mode == "parallel":
+            pyscope.render_concurrent(filename)
+        else:
+            pyscope.run(filename, framerange=(0, len(timeline)))
+        elapsed = timeit.default_timer() - start
+        size = os.path.getsize(filename)
+        with open(filename, "rb") as output:
+            digest = hashlib.sha1(output.read()).hexdigest()
+    finally:
+        sys.stdout.close()
+        sys.stdout = real_stdout
+        if os.path.exists(filename):
+            os.remove(filename)
+    # RUSAGE_CHILDREN gives the peak of the largest worker, not the sum of them
+    largest = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return {"frames": len(timeline),
+            "samples": timeline.total_samples,
+            "bytes": size,
+            "sha1": digest,
+            "seconds": elapsed,
+            "frames_per_sec": len(timeline) / elapsed,
+            "samples_per_sec": timeline.total_samples / elapsed,
+            "load_time": load_time,
+            "largest_rss_kb": largest}
+
+def best_result(runs):
+    """Combine repeated bench_scene results, keeping the best of each measure, as timings only ever get slower
+    from whatever else the machine is doing."""
+    best = dict(runs[0])
+    for measure in ("frames_per_sec", "samples_per_sec"):
+        best[measure] = max(run[measure] for run in runs)
+    for measure in ("seconds", "load_time", "largest_rss_kb"):
+        best[measure] = min(run[measure] for run in runs)
+    return best
+
+def bench_scenes(scenes, modes, frames, fps, workers, repeats=1):
+    """Run bench_scene repeats times for every scene and mode, each in a fresh interpreter, keeping the best of
+    each measure. Returns the results keyed "scene/mode"."""
+    results = {}
+    for scene in scenes:
+        for mode in modes:
+            runs = []
+            for _ in xrange(repeats):
+                output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "scene", scene, mode,
+                                                  "--frames", str(frames), "--fps", str(fps),
+                                                  "--workers", str(workers)],
+                                                 cwd=os.path.dirname(os.path.abspath(__file__)))
+                runs.append(json.loads(output.strip().splitlines()[-1]))
+            result = best_result(runs)
+            results[scene + "/" + mode] = result
+            print "   %-20s %9.1f frames/s %11.0f samples/s   load %7.2f ms   largest process %7.1f MB" % \
+                (scene + "/" + mode, result["frames_per_sec"], result["samples_per_sec"],
+                 1000.0 * result["load_time"], result["largest_rss_kb"] / 1024.0)
+    return results
+
+def find_regressions(results, baseline, tolerance=0.1):
+    """Compare results against a baseline. Returns a message for each measure that got worse by more than tolerance."""
+    worse = []
+    for key, result in sorted(results.items()):
+        if key not in baseline:
+            continue
+        old = baseline[key]
+        for measure, higher_is_better in (("frames_per_sec", True), ("samples_per_sec", True),
+                                          ("load_time", False), ("largest_rss_kb", False)):
+            if measure not in old:
+                continue
+            change = result[measure] / float(old[measure]) - 1 if old[measure] else 0.0
+            if (-change if higher_is_better else change) > tolerance:
+                worse.append("%s %s: %.4g -> %.4g (%+.1f%%)" % (key, measure, old[measure], result[measure],
+                                                                 100 * change))
+        if result["samples"] != old["samples"]:
+            worse.append("%s renders %d samples, the baseline %d" % (key, result["samples"], old["samples"]))
+    return worse
+
+def find_mismatches(results):
+    """Check that each scene rendered the same bytes on the parallel path as in a single process."""
+    mismatches = []
+    for key, result in sorted(results.items()):
+        scene, mode = key.split("/")
+        other = results.get(scene + "/single")
+        if mode != "single" and other is not None and result["sha1"] != other["sha1"]:
+            mismatches.append("%s renders different bytes from %s/single (%s, %s)" % (key, scene, result["sha1"],
+                                                                                    other["sha1"]))
+    return mismatches
+
+def bench_synthesis(edge_counts, budgets, threads, repeats=5):
+    """Time the synthesis of one frame of random edges with different numbers of threads."""
+    rng = np.random.RandomState(0)
+    for num_edges in edge_counts:
+        vecs = rng.uniform(-32766, 32766, (num_edges, 2, 2))
+        lengths = np.sqrt(((vecs[:, 1] - vecs[:, 0]) ** 2).sum(axis=1))
+        for budget in budgets:
+            counts = wav.proportional_allocation(lengths, budget)
+            base = None
+            for num_threads in threads:
+                wavout = wav.WavOutput(os.path.join(tempfile.gettempdir(), "benchmark.raw"), 60,
+                                       synth_threads=num_threads, parallel_threshold=0)
+                wavout.synthesize(vecs, counts)  # start the threads
+                start = timeit.default_timer()
+                for _ in xrange(repeats):
+                    wavout.synthesize(vecs, counts)
+                elapsed = (timeit.default_timer() - start) / repeats
+                wavout.close()
+                base = base or elapsed
+                print "   %6d edges %8d samples %2d threads %8.2f ms   (%.2fx)" % \
+                    (num_edges, budget, num_threads, 1000.0 * elapsed, base / elapsed)
+
+allocators = [("search", wav.search_allocation),
+              ("proportional", wav.proportional_allocation),
+              ("minimum", wav.MinimumAllocation(2))]
+
+scenes = ["cube", "sphere", "milkey", "shark", "text", "watchdogs"]
+
+baseline_help = """checking for regressions:
+  python benchmark.py scenes --baseline benchmarks/baseline.json
+      renders every scene in one process and on the worker pool, and exits with 1 if any
+      measure is more than --tolerance worse than in the baseline, or if the two paths
+      render different bytes
+  python benchmark.py scenes --save benchmarks/baseline.json
+      records a new baseline; commit it along with the change that moved the numbers
+
+Timings depend on the machine, so save a baseline on the machine you compare on before
+making a change. The committed one is from a single-core machine with the default options,
+where two runs still differed by up to 20% in frames per second on the parallel path and
+40% in load times of a few milliseconds; compare there with --tolerance 0.4."""
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="PyScope benchmarks. With no command, benchmark the allocators "
+                                                 "and the mesh cache.", epilog=baseline_help,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", nargs="?", choices=["scenes", "scene", "synthesis"])
+    parser.add_argument("scene", nargs="?")
+    parser.add_argument("mode", nargs="?", choices=["single", "parallel"])
+    parser.add_argument("--scenes", nargs="+", default=scenes)
+    parser.add_argument("--modes", nargs="+", default=["single", "parallel"])
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--fps", type=int, default=60)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeats", type=int, default=3, help="run each scene this many times and keep the best")
+    parser.add_argument("--save", help="write the results to this JSON file, such as benchmarks/baseline.json")
+    parser.add_argument("--baseline", help="compare the results to this JSON file, such as benchmarks/baseline.json")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="the fraction a measure may get worse by")
+    args = parser.parse_args()
+
+    if args.command == "scene":
+        print json.dumps(bench_scene(args.scene, args.mode, args.frames, args.fps, args.workers))
+    elif args.command == "synthesis":
+        print "--- synthesis on %d cores ---" % multiprocessing.cpu_count()
+        bench_synthesis([10000, 50000], [192000, 192000 * 8], args.threads)
+    elif args.command == "scenes":
+        print "--- scenes: %d frames at %d fps ---" % (args.frames, args.fps)
+        results = bench_scenes(args.scenes, args.modes, args.frames, args.fps, args.workers, args.repeats)
+        mismatches = find_mismatches(results)
+        for mismatch in mismatches:
+            print "Mismatch: " + mismatch
+        if args.save:
+            with open(args.save, "w") as baseline_file:
+                json.dump(results, baseline_file, indent=2, sort_keys=True)
+        if args.baseline:
+            with open(args.baseline) as baseline_file:
+                regressions = find_regressions(results, json.load(baseline_file), args.tolerance)
+            for regression in regressions:
+                print "Regression: " + regression
+            if regressions:
+                sys.exit(1)
+        if mismatches:
+            sys.exit(1)
+    else:
+        for name, mesh in [("cube", shape.Cuboid((0,)*3, (150,)*3)),
+                           ("sphere", shape.Spheroid((0,)*3, (150,)*3)),
+                           ("dense sphere", shape.Spheroid((0,)*3, (150,)*3, resolution=40))]:
+            print "--- %s ---" % name
+            bench_allocators(capture_frames(mesh), [192000 / 20, 192000 / 60, 192000 / 440], allocators)
+        print "--- mesh cache ---"
+        bench_mesh_cache(["shark.obj", "watchdogs.obj", "text_test.obj"])
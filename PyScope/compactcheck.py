@@ -0,0 +1,92 @@
+import pyscope
+
+import argparse
+import tempfile
+import wave
+import sys
+import os
+
+import warnings
+with warnings.catch_warnings():  # pypy's experimental version of numpy always screams at you
+    warnings.simplefilter("ignore")
+    import numpy as np
+
+
+def render_samples(scene, compact, frames, fps):
+    """Render frames of a pyscope scene at a fixed fps and return its samples as an (N, 2) int16 array."""
+    pyscope.scene = scene
+    pyscope.compact_nodes = compact
+    pyscope.fixed_fps = fps
+    pyscope.spin_times = frames * pyscope.spin_speed / float(fps)
+    filename = os.path.join(tempfile.gettempdir(), "compactcheck-%s-%d.wav" % (scene, os.getpid()))
+    real_stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        pyscope.run(filename, framerange=(0, frames))
+        audio = wave.open(filename, "r")
+        data = audio.readframes(audio.getnframes())
+        audio.close()
+    finally:
+        sys.stdout.close()
+        sys.stdout = real_stdout
+        if os.path.exists(filename):
+            os.remove(filename)
+    return np.frombuffer(data, dtype=np.int16).reshape(-1, 2)
+
+
+def off_path(path, samples, window=2):
+    """How far each of samples is from the beam path drawn by the samples of path at nearby positions.
+
+    A sample one position later or earlier along the same line is on the path, so an edge getting one sample
+    more or fewer doesn't count against the ones after it."""
+    path = path.astype(np.float64)
+    samples = samples.astype(np.float64)
+    positions = np.arange(len(path))
+    distances = np.empty(len(samples))
+    distances.fill(np.inf)
+    for shift in xrange(-window, window):
+        start = path[np.clip(positions + shift, 0, len(path) - 1)]
+        step = path[np.clip(positions + shift + 1, 0, len(path) - 1)] - start
+        along = ((samples - start) * step).sum(axis=1) / np.maximum((step * step).sum(axis=1), 1e-12)
+        nearest = start + np.clip(along, 0, 1)[:, None] * step
+        distances = np.minimum(distances, np.hypot(*(samples - nearest).T))
+    return distances
+
+
+def check_scene(scene, frames=60, fps=60, tolerance=2.0, max_moved=1e-4):
+    """Render a scene with float64 nodes and with compact float32 nodes, and compare the samples.
+
+    float32 nodes shift the projected edges by a few hundred-thousandths of a pixel. That moves samples along
+    the beam by a unit or two, and when an edge's share of the samples is right on the cutoff of rounding up,
+    gives it one sample more or fewer, which moves the samples after it one position along the path. So each
+    render's samples must lie within tolerance of the other's path, except for at most a max_moved fraction of
+    them, where an edge on the cutoff is drawn in one render and skipped in the other. Returns a list of problems."""
+    wide = render_samples(scene, False, frames, fps)
+    compact = render_samples(scene, True, frames, fps)
+    if wide.shape != compact.shape:
+        return ["%s: %d samples with float64 nodes but %d with compact nodes" % (scene, len(wide), len(compact))]
+    distances = np.maximum(off_path(wide, compact), off_path(compact, wide))
+    moved = int((distances > tolerance).sum())
+    print "   %-10s %d samples, %d differ, %d more than %g off the other's path (furthest %.1f)" % \
+        (scene, len(wide), int((wide != compact).any(axis=1).sum()), moved, tolerance, distances.max())
+    if moved > max_moved * len(wide):
+        return ["%s: %d samples are more than %g off the float64 path, more than %d allowed" %
+                (scene, moved, tolerance, int(max_moved * len(wide)))]
+    return []
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Render scenes with float64 and with compact float32 wireframe "
+                                                 "nodes and check that the beam follows the same path.")
+    parser.add_argument("--scenes", nargs="+", default=["milkey", "shark", "text"])
+    parser.add_argument("--frames", type=int, default=60)
+    parser.add_argument("--fps", type=int, default=60)
+    parser.add_argument("--tolerance", type=float, default=2.0)
+    args = parser.parse_args()
+
+    problems = []
+    for scene in args.scenes:
+        problems += check_scene(scene, args.frames, args.fps, args.tolerance)
+    for problem in problems:
+        print "Problem: " + problem
+    sys.exit(1 if problems else 0)
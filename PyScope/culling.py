@@ -0,0 +1,106 @@
+import warnings
+with warnings.catch_warnings():  # pypy's experimental version of numpy always screams at you
+    warnings.simplefilter("ignore")
+    import numpy as np
+
+
+class FaceCuller:
+    """ Drops the edges of a wireframe that the viewer can't see, using its faces.
+
+        "backface" mode drops edges whose faces all point away from the eye. "hidden" mode also
+        rasterizes the front faces into a coarse depth buffer and drops edges that lie behind it.
+        Faces are assumed to wind counter-clockwise when seen from outside, as in OBJ files. """
+
+    def __init__(self, wireframe, resolution=128, depth_tolerance=0.02):
+        self.resolution = resolution
+        self.depth_tolerance = depth_tolerance
+
+        face_lists = [list(face) for face, _ in wireframe.faces]
+        width = max(len(face) for face in face_lists)
+        # Pad short faces by repeating their last node, which adds nothing to a Newell normal
+        self.faces = np.array([face + face[-1:] * (width - len(face)) for face in face_lists], dtype=np.intp)
+
+        edges = np.asarray(wireframe.edges, dtype=np.int64).reshape(-1, 2)
+        self.edges = edges
+        self.num_edges = len(edges)
+        face_edges = np.dstack((self.faces, np.roll(self.faces, -1, axis=1))).reshape(-1, 2)
+        face_ids = np.repeat(np.arange(len(self.faces)), width)
+        face_edges = np.sort(face_edges, axis=1).astype(np.int64)
+        edges = np.sort(edges, axis=1)
+        edge_keys = (edges[:, 0] << 32) | edges[:, 1]
+        face_keys = (face_edges[:, 0] << 32) | face_edges[:, 1]
+        order = np.argsort(edge_keys)
+        found = np.minimum(np.searchsorted(edge_keys[order], face_keys), len(order) - 1)
+        matched = (edge_keys[order][found] == face_keys) & (face_edges[:, 0] != face_edges[:, 1])
+        # incidence pairs: face i borders edge j
+        self.incident_faces = face_ids[matched]
+        self.incident_edges = order[found][matched]
+        self.faceless = np.bincount(self.incident_edges, minlength=self.num_edges) == 0
+
+        # fan triangulation of each face for the depth buffer; padding gives zero-area triangles
+        self.triangles = np.concatenate([self.faces[:, [0, i, i + 1]] for i in range(1, width - 1)]) \
+            if width > 2 else np.zeros((0, 3), dtype=np.intp)
+        self.triangle_faces = np.tile(np.arange(len(self.faces)), max(width - 2, 0))
+
+    def frontFacing(self, nodes, eye):
+        """ Which faces point towards the eye. An eye of None means looking along +z from infinitely far away. """
+        points = nodes[self.faces, :3]
+        following = np.roll(points, -1, axis=1)
+        normals = np.empty((len(self.faces), 3))
+        for axis, (a, b) in enumerate(((1, 2), (2, 0), (0, 1))):
+            normals[:, axis] = ((points[..., a] - following[..., a]) * (points[..., b] + following[..., b])).sum(axis=1)
+        if eye is None:
+            return normals[:, 2] < 0
+        centroids = points.sum(axis=1) / self.faces.shape[1]
+        return (normals * (np.asarray(eye) - centroids)).sum(axis=1) > 0
+
+    def visibleEdges(self, nodes, eye, screen=None, mode="backface"):
+        """ A mask of the edges to keep. For "hidden" mode, screen is the (N, 2) projection of nodes. """
+        front = self.frontFacing(nodes, eye)
+        visible = self.faceless | (np.bincount(self.incident_edges, weights=front[self.incident_faces],
+                                               minlength=self.num_edges) > 0)
+        if mode == "hidden" and screen is not None and front.any():
+            visible &= self.unoccluded(nodes[:, 2], screen, front)
+        return visible
+
+    def unoccluded(self, depth, screen, front):
+        """ Approximate hidden-line test against a coarse depth buffer of the front-facing faces. """
+        low = screen.min(axis=0)
+        cell = max((screen.max(axis=0) - low).max() / (self.resolution - 1), 1e-9)
+        grid = (screen - low) / cell
+        span = depth.max() - depth.min()
+        zbuffer = np.full((self.resolution, self.resolution), np.inf)
+
+        triangles = self.triangles[front[self.triangle_faces]]
+        corners = grid[triangles]
+        depths = depth[triangles]
+        lo = np.floor(corners.min(axis=1)).astype(np.int64)
+        hi = np.minimum(np.ceil(corners.max(axis=1)).astype(np.int64), self.resolution - 1)
+        extent = hi - lo + 1
+        counts = extent[:, 0] * extent[:, 1]
+        owner = np.repeat(np.arange(len(triangles)), counts)
+        step = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cx = lo[owner, 0] + step % extent[owner, 0]
+        cy = lo[owner, 1] + step // extent[owner, 0]
+        a, b, c = corners[owner, 0], corners[owner, 1], corners[owner, 2]
+        area = (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # barycentric coordinates of each cell centre
+            w1 = ((cx - a[:, 0]) * (c[:, 1] - a[:, 1]) - (cy - a[:, 1]) * (c[:, 0] - a[:, 0])) / area
+            w2 = ((b[:, 0] - a[:, 0]) * (cy - a[:, 1]) - (b[:, 1] - a[:, 1]) * (cx - a[:, 0])) / area
+            w0 = 1 - w1 - w2
+            inside = (w0 >= 0) & (w1 >= 0) & (w2 >= 0) & (area != 0)
+        z = w0 * depths[owner, 0] + w1 * depths[owner, 1] + w2 * depths[owner, 2]
+        np.minimum.at(zbuffer, (cy[inside], cx[inside]), z[inside])
+
+        # an edge is hidden only if all of its sample points are behind the buffer
+        visible = self.faceless.copy()
+        edge_faces = np.zeros(self.num_edges, dtype=bool)
+        edge_faces[self.incident_edges] = True
+        ends = self.edges
+        for t in (0.25, 0.5, 0.75):
+            point = grid[ends[:, 0]] * (1 - t) + grid[ends[:, 1]] * t
+            z = depth[ends[:, 0]] * (1 - t) + depth[ends[:, 1]] * t
+            cells = np.clip(np.round(point).astype(np.int64), 0, self.resolution - 1)
+            visible |= z <= zbuffer[cells[:, 1], cells[:, 0]] + self.depth_tolerance * span
+        return visible | ~edge_faces
@@ -1,3 +1,4 @@
+import notetimeline as nt
 import ussreader as uss
 import math
 
@@ -31,9 +32,7 @@ class DrawSpeedTween(ScopeEffect):
             self.finish_delay = finish_delay
 
     def update_fps(self, viewer):
-        if viewer.wavout:
-            viewer.wavout.setfps(self.fps)
-        viewer.fixed_dt = 1.0 / float(self.fps)
+        viewer.setfps(self.fps)
 
     def create(self, viewer):
         if self.finish_delay:
@@ -56,45 +55,41 @@ class DrawSpeedTween(ScopeEffect):
 
 
 class MIDIModulator(ScopeEffect):
-    def __init__(self, filename):
-        self.notes = uss.USSReader(filename).notes
+    """Sets the fps to the frequency of each note of a score in turn, and stops at the end of the score.
+
+    The score can be a .uss file or a track of a MIDI file."""
+    def __init__(self, filename, track=None):
+        score = uss.USSReader(filename, track)
+        self.timeline = nt.NoteTimeline.from_arrays(score.freqs, score.times)
+        self.cursor = nt.NoteCursor(self.timeline, self.timeline.start)
         self.last_time = -1.0
-        self.current_time = 0.0
 
     def update_fps(self, viewer, fps):
-        if viewer.wavout:
-            viewer.wavout.setfps(fps)
-        viewer.fixed_dt = 1.0 / float(fps)
+        viewer.setfps(fps)
 
 
     def get_notes(self, time):
-        result = []
-        for note in self.notes:
-            if note[0] >= self.last_time:
-                if note[0] <= time:
-                    result.append(note)
-                else:
-                    break
+        result = self.timeline.notes_between(self.last_time, time)
         self.last_time = time
         return result
 
+    def seek(self, viewer, time):
+        """Jump straight to a time in the score."""
+        self.cursor.seek(time)
+        if self.cursor.fps is not None:
+            self.update_fps(viewer, self.cursor.fps)
+
     def create(self, viewer):
         viewer.removeEffect(DrawSpeedTween)
         viewer.time_left = None
         viewer.total_time = None
-        for note in self.get_notes(0.0)[::-1]:
-            self.notes.pop(0)
-            self.update_fps(viewer, int(note[0]))
-        self.next_note = self.notes.pop(0)
-        self.update_fps(viewer, self.next_note[0])
-        self.timer = float(self.next_note[1])
+        self.seek(viewer, self.timeline.start)
 
     def update(self, viewer, dt):
-        self.timer += dt
-        if self.timer >= self.next_note[1]:
-            print self.next_note
-            if self.next_note[0] is None:
-                viewer.running = False
-                return
-            self.update_fps(viewer, self.next_note[0])
-            self.next_note = self.notes.pop(0)
+        notes = self.cursor.advance(dt)
+        if self.cursor.finished:
+            viewer.running = False
+            return
+        if notes:
+            print notes[-1]
+            self.update_fps(viewer, self.cursor.fps)
@@ -0,0 +1,110 @@
+import warnings
+with warnings.catch_warnings():  # pypy's experimental version of numpy always screams at you
+    warnings.simplefilter("ignore")
+    import numpy as np
+
+
+def clusterNodes(nodes, cell):
+    """ Snap nodes to a grid of the given cell size and merge the nodes that share a cell.
+
+        Returns an array mapping every node to the node that stands in for its cell,
+        which is the member closest to the cell's mean position. """
+
+    points = np.asarray(nodes)[:, :3]
+    cells = np.floor((points - points.min(axis=0)) / cell).astype(np.int64)
+    _, cluster = np.unique(cells, axis=0, return_inverse=True)
+    cluster = cluster.reshape(-1)
+    counts = np.bincount(cluster)
+    means = np.array([np.bincount(cluster, weights=points[:, i]) for i in range(3)]).T / counts[:, np.newaxis]
+    distance = ((points - means[cluster]) ** 2).sum(axis=1)
+    # sort by cluster, then by distance, so the first node of each cluster is its representative
+    order = np.lexsort((distance, cluster))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return order[starts][cluster]
+
+def decimateEdges(edges, remap):
+    """ Move edges onto their nodes' representatives, dropping the ones that collapse or duplicate another. """
+    edges = np.sort(remap[np.asarray(edges, dtype=np.int64).reshape(-1, 2)], axis=1)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    keys = (edges[:, 0] << 32) | edges[:, 1]
+    _, first = np.unique(keys, return_index=True)
+    return edges[np.sort(first)].astype(np.int32)
+
+def decimateFaces(faces, remap):
+    """ Move faces onto their nodes' representatives, keeping those that still have three distinct corners. """
+    kept = []
+    for face in faces:
+        corners = remap[list(face)].tolist()
+        corners = [c for i, c in enumerate(corners) if c != corners[i - 1]]
+        if len(set(corners)) >= 3:
+            kept.append(corners)
+    return kept
+
+
+class LODLevel:
+    """ One level of an LODPyramid: the edges and faces of a decimated mesh, indexing the original nodes. """
+
+    def __init__(self, edges, faces):
+        self.edges = edges
+        self.faces = faces
+
+
+class LODPyramid:
+    """ Successively coarser versions of a wireframe, made by vertex-clustering decimation.
+
+        Every level keeps the full node array and only rewires edges onto fewer of its nodes,
+        so the levels stay valid however the wireframe's nodes are transformed afterwards.
+        Level 0 is the wireframe itself, and each further level has at most ratio times as many
+        edges as the one before, down to about min_edges edges. """
+
+    def __init__(self, levels):
+        self.levels = levels
+        self.edge_counts = np.array([len(level.edges) for level in levels])
+
+    @classmethod
+    def build(cls, wireframe, ratio=0.5, min_edges=12, growth=1.25):
+        levels = [LODLevel(wireframe.edges, wireframe.faces)]
+        if len(wireframe.nodes) < 2 or len(wireframe.edges) <= min_edges:
+            return cls(levels)
+        points = wireframe.nodes[:, :3]
+        extent = (points.max(axis=0) - points.min(axis=0)).max()
+        cell = extent / np.sqrt(len(wireframe.edges))
+        target = len(wireframe.edges) * ratio
+        while target >= min_edges and cell < extent * 2:
+            remap = clusterNodes(wireframe.nodes, cell)
+            edges = decimateEdges(wireframe.edges, remap)
+            if len(edges) <= target:
+                faces = decimateFaces([face for face, _ in wireframe.faces], remap)
+                colour = wireframe.faces[0][1] if wireframe.faces else None
+                levels.append(LODLevel(edges, [(face, colour) for face in faces]))
+                target = len(edges) * ratio
+            cell *= growth
+        return cls(levels)
+
+    @classmethod
+    def fromArrays(cls, wireframe, arrays):
+        """ Rebuild a pyramid saved with toArrays, with wireframe as level 0. """
+        levels = [LODLevel(wireframe.edges, wireframe.faces)]
+        colour = np.array((255,255,255), np.uint8)
+        for i in range(1, int(arrays["lod_levels"][0])):
+            prefix = "lod%d_" % i
+            indices = arrays[prefix + "face_indices"].tolist()
+            ends = np.cumsum(arrays[prefix + "face_lengths"]).tolist()
+            faces = [(indices[start:end], colour) for start, end in zip([0] + ends[:-1], ends)]
+            levels.append(LODLevel(arrays[prefix + "edges"], faces))
+        return cls(levels)
+
+    def toArrays(self):
+        """ The coarser levels as a dict of flat arrays, for the mesh cache. """
+        arrays = {"lod_levels": np.array([len(self.levels)], dtype=np.int32)}
+        for i, level in enumerate(self.levels[1:], 1):
+            prefix = "lod%d_" % i
+            arrays[prefix + "edges"] = np.asarray(level.edges, dtype=np.int32).reshape(-1, 2)
+            arrays[prefix + "face_indices"] = np.array([n for face, _ in level.faces for n in face], dtype=np.int32)
+            arrays[prefix + "face_lengths"] = np.array([len(face) for face, _ in level.faces], dtype=np.int32)
+        return arrays
+
+    def select(self, max_edges):
+        """ The most detailed level with no more than max_edges edges, or the coarsest level if none fit. """
+        fits = np.nonzero(self.edge_counts <= max_edges)[0]
+        return self.levels[fits[0] if len(fits) else -1]
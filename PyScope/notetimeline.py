@@ -0,0 +1,108 @@
+import bisect
+
+import warnings
+with warnings.catch_warnings():  # pypy's experimental version of numpy always screams at you
+    warnings.simplefilter("ignore")
+    import numpy as np
+
+
+class NoteTimeline:
+    """An immutable score: the start time and frequency of every note, sorted by time.
+
+    A note with a frequency of None marks the end of the score, and anything after it is dropped.
+    Scalar lookups bisect a list of the start times and array lookups use searchsorted, so both
+    stay O(log n) however long the score is. Since it never changes, copies share the same arrays."""
+
+    def __init__(self, times, freqs, end=None):
+        order = np.argsort(np.asarray(times, dtype=np.float64), kind="mergesort")
+        self.times = np.asarray(times, dtype=np.float64)[order]
+        self.freqs = np.asarray(freqs, dtype=np.float64)[order]
+        self.times.flags.writeable = False
+        self.freqs.flags.writeable = False
+        self.time_list = self.times.tolist()
+        self.end = end
+
+    @classmethod
+    def from_notes(cls, notes):
+        """Build a timeline from a list of (frequency, start time) pairs, as in ussreader.USSReader.notes."""
+        return cls.from_arrays([np.nan if freq is None else freq for freq, _ in notes], [time for _, time in notes])
+
+    @classmethod
+    def from_arrays(cls, freqs, times):
+        """Build a timeline from arrays of frequencies and start times, as read by ussreader.loadScore.
+
+        A frequency of NaN ends the score."""
+        times = np.asarray(times, dtype=np.float64)
+        order = np.argsort(times, kind="mergesort")
+        freqs = np.asarray(freqs, dtype=np.float64)[order]
+        times = times[order]
+        end = None
+        stops = np.nonzero(np.isnan(freqs))[0]
+        if len(stops):
+            end = float(times[stops[0]])
+            freqs, times = freqs[:stops[0]], times[:stops[0]]
+        return cls(times, freqs, end)
+
+    def __len__(self):
+        return len(self.time_list)
+
+    def __deepcopy__(self, memo):
+        return self
+
+    @property
+    def start(self):
+        return self.time_list[0] if self.time_list else 0.0
+
+    def index(self, time):
+        """The number of notes that have started by time."""
+        return bisect.bisect_right(self.time_list, time)
+
+    def note(self, index):
+        return (float(self.freqs[index]), self.time_list[index])
+
+    def fps_at(self, time):
+        """The frequency of the note playing at time, or None before the first note."""
+        index = self.index(time)
+        return float(self.freqs[index - 1]) if index else None
+
+    def fps_at_times(self, times):
+        """The frequency playing at each of an array of times, with NaN before the first note."""
+        indices = np.searchsorted(self.times, times, side="right")
+        return np.where(indices > 0, self.freqs[np.maximum(indices - 1, 0)], np.nan)
+
+    def finished(self, time):
+        return self.end is not None and time >= self.end
+
+    def notes_between(self, start, end):
+        """The notes starting from start up to and including end, as (frequency, time) pairs."""
+        first = bisect.bisect_left(self.time_list, start)
+        return [self.note(i) for i in xrange(first, self.index(end))]
+
+
+class NoteCursor:
+    """A position in a NoteTimeline, which can jump to any time or step forward by a frame at a time."""
+
+    def __init__(self, timeline, time=0.0):
+        self.timeline = timeline
+        self.seek(time)
+
+    def seek(self, time):
+        self.time = time
+        self.position = self.timeline.index(time)
+
+    def advance(self, dt):
+        """Move on by dt and return the notes that started along the way."""
+        self.time += dt
+        position = self.timeline.index(self.time)
+        passed = [self.timeline.note(i) for i in xrange(self.position, position)]
+        self.position = position
+        return passed
+
+    @property
+    def fps(self):
+        """The frequency of the current note, or None before the first one."""
+        return float(self.timeline.freqs[self.position - 1]) if self.position else None
+
+    @property
+    def finished(self):
+        return self.timeline.finished(self.time)
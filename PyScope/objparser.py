@@ -1,53 +1,106 @@
+import arraycache as cache
+import lod
 import wireframe as wf
 import numpy as np
 import sys
 
-def parseOBJ(filename):
+MESH_FORMAT = 2  # part of each mesh cache's key; bump it when compileOBJ's output changes
+
+def objIndex(token, num_verts):
+    """Turn an OBJ vertex reference (v, v/vt, v//vn or v/vt/vn) into a 0-based vertex index."""
+    index = int(token.split("/")[0])
+    if index > 0:
+        index -= 1  # OBJ files are 1-indexed
+    elif index < 0:
+        index += num_verts  # negative indices count back from the last vertex read
+    else:
+        raise ValueError("vertex index 0 is not allowed")
+    if not 0 <= index < num_verts:
+        raise ValueError("vertex index %s is out of range" % token)
+    return index
+
+def parseOBJ(filename, max_warnings=10):
+    """Read an OBJ file in a single pass.
+
+    Returns an (N, 3) array of vertices, a list of faces and a list of line-element edges,
+    with faces and edges given as 0-based indices into the vertex array."""
     verts = []
-    vertsOut = []
-    nodes = []
+    faces = []
+    lines = []
+    bad_lines = 0
     with open(filename, "r") as objfile:
-        #lines = 0
-        #while objfile.readline():
-        #    lines += 1
-        #objfile.seek(0,0)
-        #readlines = 0
-        for line in objfile:
-            #readlines += 1
-            #if readlines % 100 == 0:
-                #print str(int((float(readlines) / float(lines)) * 100)) + "% complete - " + str(readlines) + "/" + str(lines)
+        for number, line in enumerate(objfile, 1):
+            vals = line.split()
+            if not vals:
+                continue
             try:
-                vals = line.split()
                 if vals[0] == "v":
-                    v = map(float, (i.rstrip(",") for i in vals[1:4]))
+                    v = [float(i.rstrip(",")) for i in vals[1:4]]
+                    if len(v) != 3:
+                        raise ValueError("expected 3 coordinates")
                     verts.append(v)
-                if vals[0] == "f":
-                    face = []
-                    for f in vals[1:]:
-                        w = f.split("/")
-                        # OBJ Files are 1-indexed so we must subtract 1 below
-                        face.append(tuple(verts[int(w[0])-1]))
-                    vertsOut.append(tuple(face))
-            except:
-                pass
-    return vertsOut
+                elif vals[0] == "f":
+                    if len(vals) < 3:
+                        raise ValueError("a face needs at least 2 vertices")
+                    faces.append([objIndex(i, len(verts)) for i in vals[1:]])
+                elif vals[0] == "l":
+                    if len(vals) < 3:
+                        raise ValueError("a line needs at least 2 vertices")
+                    indices = [objIndex(i, len(verts)) for i in vals[1:]]
+                    lines.extend(zip(indices[:-1], indices[1:]))
+            except ValueError as e:
+                bad_lines += 1
+                if bad_lines <= max_warnings:
+                    print "Warning: skipping line %d of %s (%s): %s" % (number, filename, e, line.strip())
+    if bad_lines > max_warnings:
+        print "Warning: skipped %d malformed lines in %s" % (bad_lines, filename)
+    return np.array(verts, dtype=np.float64).reshape(-1, 3), faces, lines
 
-def loadOBJ(filename):
-    print "Loading OBJ " + filename
-    loaded_faces = parseOBJ(filename)
-    edges = {}
-    nodes = {}
-    for face in loaded_faces:
-        for edge in zip(list([face[-1]])+list(face[:-1]),face):
-            edges[edge] = None
-        for vertex in face:
-            nodes[vertex] = None
-    edge_indexes = {}
-    nodes = nodes.keys()
-    for edge in edges.iterkeys():
-        edge_indexes[tuple(nodes.index(i) for i in edge)] = None
-    edges = np.array(edge_indexes.keys())
-    nodes = np.array(nodes)
+def compileOBJ(filename):
+    """Parse an OBJ file into deduplicated node and edge arrays, plus faces as flat index and length arrays
+    and the levels of its LOD pyramid."""
+    verts, faces, lines = parseOBJ(filename)
+    # Keep only the vertices that are used, merging any that share a position
+    used = np.zeros(len(verts), dtype=bool)
+    for face in faces:
+        used[face] = True
+    for edge in lines:
+        used[list(edge)] = True
+    nodes, merged = np.unique(verts[used], axis=0, return_inverse=True)
+    remap = np.full(len(verts), -1, dtype=np.int64)
+    remap[used] = merged
     wireframe = wf.Wireframe(nodes)
-    wireframe.addEdges(edges)
+    wireframe.addFaces([remap[face].tolist() for face in faces])
+    wireframe.addEdges(remap[np.array(lines, dtype=np.int64).reshape(-1, 2)])
+    mesh = {"nodes": wireframe.nodes,
+            "edges": wireframe.edges,
+            "face_indices": np.array([i for face, _ in wireframe.faces for i in face], dtype=np.int32),
+            "face_lengths": np.array([len(face) for face, _ in wireframe.faces], dtype=np.int32)}
+    mesh.update(wireframe.buildLOD().toArrays())
+    return mesh
+
+def loadOBJ(filename, use_cache=True):
+    """Load an OBJ file as a Wireframe, going through its compiled sidecar cache where possible."""
+    print "Loading OBJ " + filename
+    key = None
+    mesh = None
+    if use_cache:
+        key = cache.sourceKey(filename)
+        key["mesh_format"] = MESH_FORMAT
+        mesh = cache.load(filename, key)
+    if mesh is None or "lod_levels" not in mesh:
+        mesh = compileOBJ(filename)
+        if use_cache:
+            try:
+                cache.save(filename, mesh, key)
+            except (IOError, OSError) as e:
+                print "Warning: could not write mesh cache for %s: %s" % (filename, e)
+    wireframe = wf.Wireframe()
+    wireframe.nodes = mesh["nodes"]
+    wireframe.edges = mesh["edges"]
+    colour = np.array((255,255,255), np.uint8)
+    indices = mesh["face_indices"].tolist()
+    ends = np.cumsum(mesh["face_lengths"]).tolist()
+    wireframe.faces = [(indices[start:end], colour) for start, end in zip([0] + ends[:-1], ends)]
+    wireframe.lod = lod.LODPyramid.fromArrays(wireframe, mesh)
     return wireframe
@@ -0,0 +1,85 @@
+import json
+import timeit
+
+
+def frameTime(frame):
+    """The total time of a frame's top-level phases."""
+    return sum(time for phase, time in frame["times"].iteritems() if "." not in phase)
+
+
+class Profiler:
+    """Per-frame timers and counters for the render loop.
+
+    Timers and counters are kept in a small dict per frame, so the cost of profiling is a clock read and
+    a dict update per phase. Whoever owns the loop calls beginFrame; the phases inside it call add and count.
+    Nothing is recorded before the first beginFrame. Phases named "group.phase" are parts of the phase
+    "group" and are left out when adding up the time of a whole frame."""
+
+    clock = staticmethod(timeit.default_timer)
+
+    def __init__(self):
+        self.frames = []
+        self.current = None
+
+    def beginFrame(self, frame):
+        self.current = {"frame": frame, "times": {}, "counts": {}}
+        self.frames.append(self.current)
+        return self.current
+
+    def resumeFrame(self, record):
+        """Go back to adding to a frame returned by beginFrame, for loops that work on several frames at once."""
+        self.current = record
+
+    def share(self, phase, start, records):
+        """Split the time since start evenly between the phases of several frames, such as a block projected at once."""
+        now = self.clock()
+        for record in records:
+            record["times"][phase] = record["times"].get(phase, 0.0) + (now - start) / len(records)
+        return now
+
+    def add(self, phase, start):
+        """Charge the time since start to a phase of the current frame. Returns the time now, to start the next phase."""
+        now = self.clock()
+        if self.current is not None:
+            times = self.current["times"]
+            times[phase] = times.get(phase, 0.0) + (now - start)
+        return now
+
+    def count(self, name, value=1):
+        if self.current is not None:
+            counts = self.current["counts"]
+            counts[name] = counts.get(name, 0) + value
+
+    def take(self):
+        """Hand over the frames recorded so far and start afresh, e.g. to send them back from a worker."""
+        frames = self.frames
+        self.frames = []
+        self.current = None
+        return frames
+
+    def extend(self, frames):
+        """Add frames recorded by another profiler, such as a worker's."""
+        self.frames.extend(frames)
+
+    def summary(self, outliers=10):
+        """Totals, means and maxima of every timer and counter, plus the slowest frames."""
+        summary = {"frames": len(self.frames), "times": {}, "counts": {}}
+        for kind in ("times", "counts"):
+            names = set(name for frame in self.frames for name in frame[kind])
+            for name in sorted(names):
+                values = [(frame[kind].get(name, 0), frame["frame"]) for frame in self.frames]
+                total = sum(value for value, _ in values)
+                peak, peak_frame = max(values)
+                summary[kind][name] = {"total": total, "mean": total / float(len(values)),
+                                       "max": peak, "max_frame": peak_frame}
+        slowest = sorted(self.frames, key=frameTime, reverse=True)[:outliers]
+        summary["slowest_frames"] = [{"frame": frame["frame"], "time": frameTime(frame)} for frame in slowest]
+        return summary
+
+    def save(self, prefix):
+        """Write the summary to prefix.json and one line of JSON per frame to prefix.trace.jsonl."""
+        with open(prefix + ".json", "w") as summary_file:
+            json.dump(self.summary(), summary_file, indent=2, sort_keys=True)
+        with open(prefix + ".trace.jsonl", "w") as trace_file:
+            for frame in sorted(self.frames, key=lambda frame: frame["frame"]):
+                trace_file.write(json.dumps(frame, sort_keys=True) + "\n")
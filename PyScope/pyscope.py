@@ -4,11 +4,14 @@ import wavoutput as wav
 import objparser as obj
 import wireframe as wf
 import effects as fx
+import timeline as tl
+import trajectory as traj
+import profiler as prof
+import beampath as bp
 
 import multiprocessing
-import shutil
-import errno
 import sys
+import io
 import os
 
 import warnings
@@ -25,30 +28,138 @@ def run(filename, framerange=None, get_viewer=False, silent=False):
         assert framerange[1] - framerange[0] > 0
     viewer = wd.WireframeViewer(800, run_time=(1.0 / spin_speed) * spin_times, filename=filename, show_view=False)
     setup_viewer(viewer)
+    if profile_prefix:
+        viewer.enableProfiling()
     if framerange is not None:
         viewer.fast_forward(framerange[0])
         if framerange[1] is not None:
-            viewer.record(framerange[1] - framerange[0])
+            viewer.record(framerange[1] - framerange[0], block_size=frames_per_block)
         else:
             viewer.run()
     else:
         viewer.run()
+    if profile_prefix:
+        viewer.profiler.save(profile_prefix)
+    print bp.describe(viewer.wavout.planner.take())
     if silent:
         real_stdout.write("Worker for " + filename + " finished.\n")
 
 
-def get_num_frames():
+worker_viewer = None
+worker_output = None
+worker_checkpoints = []
+
+def init_worker(checkpoints):
+    global worker_checkpoints
+    worker_checkpoints = checkpoints
+
+def render_chunk(framerange):
+    """Render the frames in [start, end) in a pool worker. Returns their samples, their profile if profiling
+    and the beam path planner's totals for them.
+
+    Each worker keeps its viewer between chunks and seeks to the start of each one
+    from the nearest checkpoint, rather than replaying the animation from the start."""
+    global worker_viewer, worker_output
+    start, end = framerange
+    real_stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        if worker_viewer is None:
+            worker_output = io.BytesIO()
+            worker_viewer = wd.WireframeViewer(800, run_time=(1.0 / spin_speed) * spin_times, filename=worker_output,
+                                               show_view=False)
+            setup_viewer(worker_viewer)
+            if profile_prefix:
+                worker_viewer.enableProfiling()
+        worker_viewer.seek(start, worker_checkpoints)
+        worker_viewer.record(end - start, finish=False, block_size=frames_per_block)
+        worker_viewer.wavout.flush(wait=True)
+        samples = worker_output.getvalue()
+        worker_output.seek(0)
+        worker_output.truncate()
+        profile = worker_viewer.profiler.take() if worker_viewer.profiler else None
+        planned = worker_viewer.wavout.planner.take()
+    finally:
+        sys.stdout.close()
+        sys.stdout = real_stdout
+    return samples, profile, planned
+
+def render_concurrent(filename, workers=None, chunk_samples=None):
+    """Render the whole animation on a pool of worker processes, writing chunks to filename as they arrive in order.
+
+    Chunks are cut from the timeline so that each holds about chunk_samples samples, however fast the fps changes."""
+    workers = workers or num_workers
+    chunk_samples = chunk_samples or samples_per_chunk
+    timeline = get_timeline()
+    checkpoints, total_frames = plan_checkpoints()
+    chunks = timeline.chunks(chunk_samples)
+    print "Rendering %d frames (%d samples) in %d chunks on %d workers..." % \
+        (total_frames, timeline.total_samples, len(chunks), workers)
+    final_wav = wav.WavOutput(filename, 60)
+    profiler = prof.Profiler()
+    totals = {"frames": 0, "jump_distance": 0.0, "plan_time": 0.0}
+    pool = multiprocessing.Pool(workers, init_worker, (checkpoints,))
+    try:
+        for i, (samples, profile, planned) in enumerate(pool.imap(render_chunk, chunks)):
+            start, end = chunks[i]
+            if profile:
+                profiler.extend(profile)
+            for name, value in planned.iteritems():
+                totals[name] += value
+            if len(samples) != timeline.bytes_per_sample * timeline.samples_between(start, end):
+                print "Warning: frames %d-%d rendered %d bytes, expected %d at offset %d" % \
+                    (start, end, len(samples), timeline.bytes_per_sample * timeline.samples_between(start, end),
+                     timeline.byte_offset(start))
+            final_wav.buffer_wav(samples)
+            if i % 10 == 9:
+                print "%d/%d chunks written" % (i + 1, len(chunks))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    final_wav.close()
+    if profile_prefix:
+        profiler.save(profile_prefix)
+    print bp.describe(totals)
+    print "Done!"
+
+def plan_checkpoints(interval=None):
+    """Snapshot the scene every interval frames. Returns the snapshots and the total number of frames."""
     viewer = wd.WireframeViewer(800, run_time=(1.0 / spin_speed) * spin_times, filename=None, show_view=False)
     setup_viewer(viewer)
-    return viewer.lazycount()
+    checkpoints = viewer.plan_checkpoints(interval or checkpoint_interval)
+    return checkpoints, viewer.frame
+
+def get_timeline():
+    viewer = wd.WireframeViewer(800, run_time=(1.0 / spin_speed) * spin_times, filename=None, show_view=False)
+    setup_viewer(viewer)
+    return tl.Timeline.from_viewer(viewer)
+
+def get_num_frames():
+    return len(get_timeline())
 
 spin_speed = 0.05
 spin_times = 1.25
 fps = 1
+frame_cache_bytes = 64 * 1024 * 1024  # memory for reusing the samples of repeated frames, or 0 to turn it off
+synth_threads = 1  # threads to share the synthesis of very large frames
+compact_nodes = False  # keep wireframe nodes as float32 and transform them in place
+pack_scene = False  # keep all the wireframes in one node array, to transform and project them together
+fixed_fps = None  # render at this fps throughout, leaving out the scene's fps effects (as the benchmarks do)
 scene = "milkey"
+culling = None  # or "backface" to drop edges facing away, or "hidden" to also drop occluded ones
+lod_samples_per_edge = None  # or e.g. 4 to draw coarser meshes when there are too few samples per frame
 
 concurrent = True
 num_workers = 10
+samples_per_chunk = 192000 / 4
+checkpoint_interval = 64
+frames_per_block = 32
+output_filename = os.path.join("oscilloscope", "data", "konichiwa.wav")
+profile_prefix = None  # e.g. "profile" to write a summary to profile.json and a per-frame trace to profile.trace.jsonl
+stream_target = None  # e.g. "tcp://127.0.0.1:11995" to play live instead of writing output_filename
 
 
 def setup_viewer(viewer):
@@ -79,6 +190,9 @@ def setup_viewer(viewer):
     elif scene == "sphere":
         viewer.addEffect(fx.DrawSpeedTween(0.25, 130, 0.25, 20))
         viewer.addWireframe('spin', shape.Spheroid((0,)*3, (150,)*3))
+    if compact_nodes:
+        for wireframe in viewer.wireframes.values():
+            wireframe.makeCompact()
     if scene != "milkey":
         viewer.centerWireframe("spin")
     else:
@@ -87,67 +201,30 @@ def setup_viewer(viewer):
         viewer.wireframes["left_ear"].transform(wf.translationMatrix(150, -150, 0))
         viewer.centerWireframe("right_ear")
         viewer.wireframes["right_ear"].transform(wf.translationMatrix(-150, -150, 0))
+        # the ears follow the head around
+        viewer.scene.attach("head")
+        viewer.scene.attach("left_ear", "head")
+        viewer.scene.attach("right_ear", "head")
+    if pack_scene:
+        viewer.pack()
+    # Spin about the rest-pose centre as a function of time, so frames can be evaluated in blocks
+    spinner = "head" if scene == "milkey" else "spin"
+    viewer.scene.setTrajectory(spinner, traj.Spin(viewer.wireframes[spinner].findCenter(), (0,1,0), spin_speed))
+    viewer.culling = culling
+    viewer.lod_samples_per_edge = lod_samples_per_edge
+    if viewer.wavout:
+        viewer.wavout.synth_threads = synth_threads
+    if viewer.wavout and frame_cache_bytes:
+        viewer.wavout.frame_cache = wav.FrameCache(frame_cache_bytes)
+    if fixed_fps:
+        viewer.effects = []
+        viewer.setfps(fixed_fps)
     viewer.key_to_function = {}
-    viewer.object_update = object_update
-
-def object_update(self, dt):
-    if scene == "milkey":
-        self.wireframes['head'].transform(wf.rotateAboutVector(self.wireframes['head'].findCenter(), (0,1,0), np.pi * 2 * spin_speed * dt))
-        self.wireframes['left_ear'].transform(wf.rotateAboutVector(self.wireframes['head'].findCenter(), (0,1,0), np.pi * 2 * spin_speed * dt))
-        self.wireframes['right_ear'].transform(wf.rotateAboutVector(self.wireframes['head'].findCenter(), (0,1,0), np.pi * 2 * spin_speed * dt))
-    else:
-        self.wireframes['spin'].transform(wf.rotateAboutVector(self.wireframes['spin'].findCenter(), (0,1,0), np.pi * 2 * spin_speed * dt))
 
 if __name__ == '__main__':
-    if concurrent:
-        total_frames = get_num_frames()
-        print "Dividing workload among workers..."
-        fpw = int(total_frames / num_workers)
-        frameranges = []
-        start = 0
-        for i in range(num_workers):
-            end = start + fpw
-            frameranges.append((start, end))
-            start = end + 1
-        frameranges[-1] = (frameranges[-1][0], None)
-        frameprocesses = []
-        try:
-            shutil.rmtree("./temp/")
-            while os.path.isdir("./temp/"):
-                pass
-        except:
-            pass
-        try:
-            os.makedirs("./temp/")
-        except OSError as exception:
-            if exception.errno != errno.EEXIST:
-                raise
-        print "Running workers..."
-        for i, frange in enumerate(frameranges):
-            mp = multiprocessing.Process(target=run, args=("temp/" + str(i) + ".raw", frange, False, True))
-            mp.start()
-            frameprocesses.append(mp)
-        while frameprocesses != []:
-            for proc in frameprocesses:
-                if not proc.is_alive():
-                    proc.join()
-                    frameprocesses.remove(proc)
-        print "Stitching temp files together..."
-        final_wav = wav.WavOutput("oscilloscope\data\konichiwa.wav", 60)
-        for i in range(len(frameranges)):
-            filepath = "./temp/" + str(i) + ".raw"
-            print filepath[2:]
-            with open(filepath, "rb") as rawdata:
-                while True:
-                    buf = rawdata.read(8192)
-                    if not buf:
-                        break
-                    final_wav.buffer_wav(buf)
-        final_wav.buffer_wav(None)
-        print "Done!"
-        try:
-            shutil.rmtree("./temp/")
-        except:
-            pass
+    if stream_target:
+        run(stream_target)
+    elif concurrent:
+        render_concurrent(output_filename)
     else:
-        run("oscilloscope\data\konichiwa.wav")
\ No newline at end of file
+        run(output_filename)
@@ -0,0 +1,177 @@
+import trajectory as traj
+
+import warnings
+with warnings.catch_warnings():  # pypy's experimental version of numpy always screams at you
+    warnings.simplefilter("ignore")
+    import numpy as np
+
+
+def sameMatrix(a, b):
+    """ Whether two world matrices are the same, with None standing for a wireframe left where it is. """
+    return a is b or (a is not None and b is not None and np.array_equal(a, b))
+
+
+class SceneNode:
+    """ A wireframe placed in the scene by a local transform, relative to its parent node if it has one. """
+
+    def __init__(self, name, wireframe):
+        self.name = name
+        self.wireframe = wireframe
+        self.local = np.identity(4)
+        self.parent = None
+        self.children = []
+        self.world = None
+        self.trajectory = None
+
+    def invalidate(self):
+        """ Forget the cached world matrix of this node and everything attached to it. """
+        if self.world is not None:
+            self.world = None
+            for child in self.children:
+                child.invalidate()
+
+    def worldMatrix(self):
+        """ Compose the local transforms from the root down, caching the result until something changes. """
+        if self.world is None:
+            if self.parent is None:
+                self.world = self.local
+            else:
+                self.world = np.dot(self.local, self.parent.worldMatrix())
+        return self.world
+
+    def worldNodes(self):
+        """ The wireframe's rest-pose nodes placed in the world. """
+        return np.dot(self.wireframe.nodes, self.worldMatrix())
+
+
+class SceneGraph:
+    """ Local transforms and parent/child attachments layered over the wireframes of a WireframeGroup.
+
+        The wireframes' own nodes are left alone as the rest pose. Transforms are composed into world
+        matrices only when asked for, and applied to the nodes once, when the scene is projected.
+        Wireframes that have not been added to the graph are used as they are. """
+
+    def __init__(self, group):
+        self.group = group
+        self.nodes = {}
+        self.time = 0.0
+
+    def node(self, name):
+        if name not in self.nodes:
+            self.nodes[name] = SceneNode(name, self.group.wireframes[name])
+        return self.nodes[name]
+
+    def attach(self, name, parent=None):
+        """ Make one wireframe follow another. With no parent, the wireframe is placed relative to the world. """
+        node = self.node(name)
+        if parent is not None:
+            ancestor = self.node(parent)
+            while ancestor is not None:
+                if ancestor is node:
+                    raise Exception("Cannot attach " + name + " to its own descendant " + parent + ".")
+                ancestor = ancestor.parent
+        if node.parent is not None:
+            node.parent.children.remove(node)
+        node.parent = self.nodes[parent] if parent is not None else None
+        if node.parent is not None:
+            node.parent.children.append(node)
+        node.invalidate()
+
+    def setLocal(self, name, matrix):
+        """ Replace a wireframe's transform relative to its parent. """
+        node = self.node(name)
+        node.local = np.asarray(matrix, dtype=np.float64)
+        node.invalidate()
+
+    def transformLocal(self, name, matrix):
+        """ Apply a further transformation to a wireframe's local transform. """
+        node = self.node(name)
+        self.setLocal(name, np.dot(node.local, matrix))
+
+    def setTrajectory(self, name, trajectory):
+        """ Drive a wireframe's local transform from a function of time, such as a trajectory.Spin. """
+        self.node(name).trajectory = trajectory
+        self.setLocal(name, trajectory.matrices([self.time])[0])
+
+    def setTime(self, time):
+        """ Move every wireframe with a trajectory to where it is at the given time. """
+        self.time = time
+        for name, node in self.nodes.iteritems():
+            if node.trajectory is not None:
+                self.setLocal(name, node.trajectory.matrices([time])[0])
+
+    def worldMatricesAt(self, name, times):
+        """ A wireframe's world matrix at each of an array of times, as an (F, 4, 4) stack. """
+        if name not in self.nodes:
+            return traj.identityMatrices(len(times))
+        node = self.nodes[name]
+        if node.trajectory is not None:
+            matrices = node.trajectory.matrices(times)
+        else:
+            matrices = np.tile(node.local, (len(times), 1, 1))
+        if node.parent is not None:
+            matrices = np.matmul(matrices, self.worldMatricesAt(node.parent.name, times))
+        return matrices
+
+    def worldNodesAt(self, name, times):
+        """ A wireframe's nodes placed in the world at each of an array of times, as an (F, N, 4) array. """
+        return traj.transformNodes(self.group.wireframes[name].nodes, self.worldMatricesAt(name, times))
+
+    def worldMatrix(self, name):
+        if name in self.nodes:
+            return self.nodes[name].worldMatrix()
+        return np.identity(4)
+
+    def worldNodes(self, name):
+        if name in self.nodes:
+            return self.nodes[name].worldNodes()
+        return self.group.wireframes[name].nodes
+
+    def packedRuns(self, packed, matrices):
+        """ Split a PackedScene into runs of consecutive wireframes with the same world matrices,
+            such as parts attached to one parent, as (first node, end node, matrices) triples. """
+        runs = []
+        for i, matrix in enumerate(matrices):
+            if runs and sameMatrix(runs[-1][2], matrix):
+                runs[-1][1] = packed.node_starts[i+1]
+            else:
+                runs.append([packed.node_starts[i], packed.node_starts[i+1], matrix])
+        return runs
+
+    def packedWorldNodes(self, packed):
+        """ The nodes of a PackedScene placed in the world, as one (N, 4) array, with one product per run of wireframes. """
+        runs = self.packedRuns(packed, [self.worldMatrix(name) if name in self.nodes else None for name in packed.names])
+        if len(runs) == 1 and runs[0][2] is None:
+            return packed.nodes
+        world = np.empty_like(packed.nodes)
+        for start, end, matrix in runs:
+            world[start:end] = packed.nodes[start:end] if matrix is None else np.dot(packed.nodes[start:end], matrix)
+        return world
+
+    def packedWorldNodesAt(self, packed, times):
+        """ The nodes of a PackedScene placed in the world at each of an array of times, as an (F, N, 4) array. """
+        runs = self.packedRuns(packed, [self.worldMatricesAt(name, times) for name in packed.names])
+        world = np.empty((len(times),) + packed.nodes.shape)
+        for start, end, matrices in runs:
+            world[:, start:end] = traj.transformNodes(packed.nodes[start:end], matrices)
+        return world
+
+    def findCenter(self, name=None):
+        """ Find the centre of one wireframe, or of the whole group, as placed in the world. """
+        packed = self.group.packedScene() if name is None else None
+        if packed is not None:
+            nodes = self.packedWorldNodes(packed)[:,:-1]
+            return 0.5*(nodes.min(axis=0) + nodes.max(axis=0))
+        names = [name] if name is not None else self.group.wireframes.keys()
+        nodes = [self.worldNodes(n)[:,:-1] for n in names]
+        min_values = np.array([n.min(axis=0) for n in nodes]).min(axis=0)
+        max_values = np.array([n.max(axis=0) for n in nodes]).max(axis=0)
+        return 0.5*(min_values + max_values)
+
+    def state(self):
+        """ The local transforms, for checkpointing. Attachments are set up once and not included. """
+        return dict((name, node.local.copy()) for name, node in self.nodes.iteritems())
+
+    def setState(self, state):
+        for name, local in state.iteritems():
+            self.setLocal(name, local.copy())
@@ -0,0 +1,110 @@
+import wavoutput as wav
+
+import threading
+import argparse
+import socket
+import time
+import sys
+
+import warnings
+with warnings.catch_warnings():  # pypy's experimental version of numpy always screams at you
+    warnings.simplefilter("ignore")
+    import numpy as np
+
+
+class Listener(threading.Thread):
+    """A local TCP or UDP socket that takes in everything sent to it, noting when the first and last bytes arrived."""
+
+    def __init__(self, kind):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.kind = kind
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM if kind == "tcp" else socket.SOCK_DGRAM)
+        if kind == "udp":
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.sock.bind(("127.0.0.1", 0))
+        if kind == "tcp":
+            self.sock.listen(1)
+        self.target = "%s://127.0.0.1:%d" % (kind, self.sock.getsockname()[1])
+        self.received = 0
+        self.first = None
+        self.last = None
+        self.start()
+
+    def run(self):
+        if self.kind == "tcp":
+            connection, _ = self.sock.accept()
+        else:
+            connection = self.sock
+            connection.settimeout(1.0)
+        while True:
+            try:
+                data = connection.recv(65536)
+            except socket.timeout:
+                return
+            if not data:
+                return
+            now = time.time()
+            self.first = self.first or now
+            self.last = now
+            self.received += len(data)
+
+
+def check_stream(kind, seconds=1.0, fps=60, rate=192000, num_buffers=16, stall_frames=0):
+    """Stream seconds of a spinning square to a local listener, stalling on stall_frames frames for twice as
+    long as the stream holds in reserve.
+
+    The reserve is num_buffers buffers, more than the oscilloscope's 4, so that a busy machine doesn't cause
+    underruns of its own. Returns a list of problems: the wrong number of bytes arriving, the stream going
+    out faster or slower than real time, or underruns that should or should not have happened."""
+    listener = Listener(kind)
+    output = wav.StreamOutput(listener.target, fps, rate=rate, num_buffers=num_buffers)
+    frames = int(seconds * fps)
+    stalls = set(np.linspace(0, frames - 1, stall_frames).astype(int).tolist()) if stall_frames else set()
+    square = np.array([[0, 0], [1, 0], [1, 1], [0, 1]], dtype=np.float64)
+    start = time.time()
+    for frame in xrange(frames):
+        if frame in stalls:
+            time.sleep(2 * output.writer.lead)
+        angle = 2 * np.pi * frame / float(frames)
+        corners = 400 + 200 * np.dot(square - 0.5, [[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+        output.wavify(np.stack((corners, np.roll(corners, -1, axis=0)), axis=1), 800)
+    output.close()
+    elapsed = time.time() - start
+    listener.join(5.0)
+
+    problems = []
+    expected = frames * int(rate / fps) * 4
+    duration = expected / (rate * 4.0)
+    if listener.received != expected:
+        problems.append("%s: received %d bytes, expected %d" % (kind, listener.received, expected))
+    if not stalls and abs(elapsed - duration) > 0.1 * duration:
+        problems.append("%s: sent %.2f seconds of samples in %.2f seconds" % (kind, duration, elapsed))
+    if listener.first is not None and not stalls and abs(listener.last - listener.first - duration) > 0.1 * duration:
+        problems.append("%s: %.2f seconds of samples arrived over %.2f seconds" %
+                        (kind, duration, listener.last - listener.first))
+    if stalls and not output.underruns:
+        problems.append("%s: stalled %d times without an underrun" % (kind, len(stalls)))
+    if not stalls and output.underruns:
+        problems.append("%s: %d underruns without stalling" % (kind, output.underruns))
+    print "   %s %s: %d bytes in %.2f s for %.2f s of samples, %d underruns" % \
+        (kind, "stalled" if stalls else "steady", listener.received, elapsed, duration, output.underruns)
+    return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stream to local sockets and check the byte count, pacing and "
+                                                 "underrun counting of wavoutput.StreamOutput.")
+    parser.add_argument("--kinds", nargs="+", choices=["tcp", "udp"], default=["tcp", "udp"])
+    parser.add_argument("--seconds", type=float, default=1.0)
+    parser.add_argument("--fps", type=int, default=60)
+    parser.add_argument("--buffers", type=int, default=16)
+    args = parser.parse_args()
+
+    problems = []
+    for kind in args.kinds:
+        problems += check_stream(kind, args.seconds, args.fps, num_buffers=args.buffers)
+        problems += check_stream(kind, args.seconds, args.fps, num_buffers=args.buffers, stall_frames=3)
+    for problem in problems:
+        print "Problem: " + problem
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,100 @@
+import sys
+import os
+
+import warnings
+with warnings.catch_warnings():  # pypy's experimental version of numpy always screams at you
+    warnings.simplefilter("ignore")
+    import numpy as np
+
+
+class Timeline:
+    """The timing of every frame of an animation: its dt, fps and number of output samples.
+
+    Since samples per frame is rate / fps and effects change the fps as they go, frames can differ
+    in size by orders of magnitude. The cumulative sample offsets give each frame's exact position
+    in the output, and let work be split by how much audio it produces instead of by frame count."""
+
+    bytes_per_sample = 4  # 16-bit stereo
+    header_size = 44  # a plain PCM WAV header
+
+    def __init__(self, dts, fps, samples, rate=192000):
+        self.dts = np.asarray(dts, dtype=np.float64)
+        self.fps = np.asarray(fps, dtype=np.float64)
+        self.samples = np.asarray(samples, dtype=np.int64)
+        self.rate = rate
+        self.offsets = np.concatenate(([0], np.cumsum(self.samples)))
+
+    @classmethod
+    def from_viewer(cls, viewer, rate=192000):
+        """Step a freshly set up viewer's effects through the whole animation without rendering anything.
+
+        This consumes the viewer's effects, so don't use the same viewer for rendering afterwards."""
+        real_stdout = sys.stdout
+        sys.stdout = open(os.devnull,"w")
+        try:
+            if not viewer.has_run:
+                for effect in viewer.effects:
+                    effect.create(viewer)
+            viewer.has_run = True
+            viewer.running = True
+            dts = []
+            fps = []
+            samples = []
+            while viewer.running:
+                # without an fps of its own the viewer's WavOutput runs at 60
+                frame_fps = viewer.fps or 60
+                dt = viewer.getdelta()
+                dts.append(dt)
+                fps.append(frame_fps)
+                samples.append(int(rate / frame_fps))  # same arithmetic as WavOutput.setfps
+                viewer.frame_update(viewer, dt)
+                for effect in viewer.effects:
+                    effect.update(viewer, dt)
+                viewer.frame += 1
+            viewer.running = False
+        finally:
+            sys.stdout.close()
+            sys.stdout = real_stdout
+        return cls(dts, fps, samples, rate)
+
+    def __len__(self):
+        return len(self.samples)
+
+    @property
+    def total_samples(self):
+        return int(self.offsets[-1])
+
+    @property
+    def duration(self):
+        return float(self.dts.sum())
+
+    def sample_offset(self, frame):
+        """Index of the first sample of a frame in the output."""
+        return int(self.offsets[frame])
+
+    def byte_offset(self, frame, header=True):
+        """Position of the first byte of a frame in the output file."""
+        return (self.header_size if header else 0) + self.bytes_per_sample * self.sample_offset(frame)
+
+    def samples_between(self, start, end):
+        return int(self.offsets[end] - self.offsets[start])
+
+    def partition(self, parts, weights=None):
+        """Split the frames into parts contiguous (start, end) ranges of roughly equal weight.
+
+        Frames are weighted by their sample counts, unless per-frame weights such as measured costs are given."""
+        if weights is None:
+            cumulative = self.offsets
+        else:
+            cumulative = np.concatenate(([0], np.cumsum(weights, dtype=np.float64)))
+        targets = cumulative[-1] * np.arange(1, parts) / float(parts)
+        return self.ranges(np.searchsorted(cumulative, targets))
+
+    def chunks(self, samples_per_chunk):
+        """Split the frames into contiguous (start, end) ranges of about samples_per_chunk samples each."""
+        targets = np.arange(samples_per_chunk, self.total_samples, samples_per_chunk)
+        return self.ranges(np.searchsorted(self.offsets, targets))
+
+    def ranges(self, cuts):
+        cuts = np.unique(np.concatenate(([0], cuts, [len(self)])).astype(np.int64))
+        return [(int(start), int(end)) for start, end in zip(cuts[:-1], cuts[1:])]
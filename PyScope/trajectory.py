@@ -0,0 +1,116 @@
+import warnings
+with warnings.catch_warnings():  # pypy's experimental version of numpy always screams at you
+    warnings.simplefilter("ignore")
+    import numpy as np
+
+# Vectorized versions of the matrix builders in wireframe.py. Each takes an array of F values
+# and returns an (F, 4, 4) stack of matrices in the same row-vector convention.
+
+def identityMatrices(count):
+    return np.tile(np.identity(4), (count, 1, 1))
+
+def translationMatrices(offsets):
+    """ Return matrices for translation along each row of an (F, 3) array. """
+
+    offsets = np.atleast_2d(np.asarray(offsets, dtype=np.float64))
+    matrices = identityMatrices(len(offsets))
+    matrices[:, 3, :3] = offsets
+    return matrices
+
+def scaleMatrices(scales, (cx,cy,cz)=(0,0,0)):
+    """ Return matrices for scaling equally along all axes by each of an array of factors, centred on (cx,cy,cz). """
+
+    scales = np.atleast_1d(np.asarray(scales, dtype=np.float64))
+    matrices = identityMatrices(len(scales))
+    for axis in range(3):
+        matrices[:, axis, axis] = scales
+    matrices[:, 3, :3] = np.outer(1 - scales, (cx, cy, cz))
+    return matrices
+
+def rotationMatrices(radians, first, second):
+    radians = np.atleast_1d(np.asarray(radians, dtype=np.float64))
+    c = np.cos(radians)
+    s = np.sin(radians)
+    matrices = identityMatrices(len(radians))
+    matrices[:, first, first] = c
+    matrices[:, first, second] = -s
+    matrices[:, second, first] = s
+    matrices[:, second, second] = c
+    return matrices
+
+def rotateXMatrices(radians):
+    """ Return matrices for rotating about the x-axis by each of an array of angles """
+    return rotationMatrices(radians, 1, 2)
+
+def rotateYMatrices(radians):
+    """ Return matrices for rotating about the y-axis by each of an array of angles """
+    return rotationMatrices(radians, 2, 0)
+
+def rotateZMatrices(radians):
+    """ Return matrices for rotating about the z-axis by each of an array of angles """
+    return rotationMatrices(radians, 0, 1)
+
+def rotateAboutVectorMatrices((cx,cy,cz), axis, radians):
+    """ Return matrices for rotating about the line through (cx,cy,cz) along axis by each of an array of angles.
+
+        Uses the Rodrigues form, which gives the same matrices as wireframe.rotateAboutVector without the
+        chain of seven matrix products. """
+
+    radians = np.atleast_1d(np.asarray(radians, dtype=np.float64))
+    (x, y, z) = np.asarray(axis, dtype=np.float64) / np.linalg.norm(axis)
+    c = np.cos(radians)[:, np.newaxis, np.newaxis]
+    s = np.sin(radians)[:, np.newaxis, np.newaxis]
+    cross = np.array([[ 0,-z, y],
+                      [ z, 0,-x],
+                      [-y, x, 0]])
+    outer = np.outer((x, y, z), (x, y, z))
+    rotation = c * np.identity(3) + s * cross + (1 - c) * outer
+    center = np.array([cx, cy, cz], dtype=np.float64)
+    matrices = identityMatrices(len(radians))
+    matrices[:, :3, :3] = rotation
+    matrices[:, 3, :3] = center - np.dot(center, rotation)
+    return matrices
+
+def transformNodes(nodes, matrices):
+    """ Apply each of an (F, 4, 4) stack of matrices to an (N, 4) node array, giving (F, N, 4). """
+    return np.einsum('nj,fjk->fnk', nodes, matrices)
+
+
+class Spin:
+    """ A constant-speed rotation about an axis through a point, at speed turns per second. """
+
+    def __init__(self, center, axis, speed):
+        self.center = center
+        self.axis = axis
+        self.speed = speed
+
+    def matrices(self, times):
+        return rotateAboutVectorMatrices(self.center, self.axis, np.pi * 2 * self.speed * np.asarray(times))
+
+
+class Keyframes:
+    """ Rotation about an axis, translation and scale, interpolated linearly between keyframes.
+
+        Each transform is applied in that order (scale, then rotate, then translate) about center,
+        and holds its first or last value outside the keyframed times. """
+
+    def __init__(self, times, angles=None, translations=None, scales=None, axis=(0,1,0), center=(0,0,0)):
+        self.times = np.asarray(times, dtype=np.float64)
+        self.angles = None if angles is None else np.asarray(angles, dtype=np.float64)
+        self.translations = None if translations is None else np.asarray(translations, dtype=np.float64)
+        self.scales = None if scales is None else np.asarray(scales, dtype=np.float64)
+        self.axis = axis
+        self.center = center
+
+    def matrices(self, times):
+        times = np.atleast_1d(np.asarray(times, dtype=np.float64))
+        matrices = identityMatrices(len(times))
+        if self.scales is not None:
+            matrices = np.matmul(matrices, scaleMatrices(np.interp(times, self.times, self.scales), self.center))
+        if self.angles is not None:
+            angles = np.interp(times, self.times, self.angles)
+            matrices = np.matmul(matrices, rotateAboutVectorMatrices(self.center, self.axis, angles))
+        if self.translations is not None:
+            offsets = np.array([np.interp(times, self.times, self.translations[:, i]) for i in range(3)]).T
+            matrices = np.matmul(matrices, translationMatrices(offsets))
+        return matrices
@@ -1,18 +1,193 @@
+import arraycache as cache
 import struct
+import re
+
+import warnings
+with warnings.catch_warnings():  # pypy's experimental version of numpy always screams at you
+    warnings.simplefilter("ignore")
+    import numpy as np
+
+# Scores are read as two arrays: the frequency of each note, with NaN for the None note that
+# ends the score, and the time in seconds it starts.
+
+SETTING = re.compile(r"^\s*(tempo|resolution)\s*=\s*([-+0-9.eE]+)\s*(#.*)?$")
+NUMBER = r"\s*(None|[-+]?[0-9]*\.?[0-9]+(?:[eE][-+]?[0-9]+)?)\s*"
+NOTE = re.compile(r"\(" + NUMBER + "," + NUMBER + r"\)")
+NOTES_START = re.compile(r"^\s*notes\s*=\s*\[")
+
+
+def notenumbertofreq(notenum):
+    #https://en.wikipedia.org/wiki/MIDI_Tuning_Standard
+    return (2.0**((np.asarray(notenum, dtype=np.float64)-69)/12.0)) * 440.0
+
+def parseUSS(filename, max_warnings=10):
+    """Read a .uss score line by line, without executing it.
+
+    Understands the tempo and resolution settings and a notes list of (note number, tick) pairs,
+    which may be spread over any number of lines. Any other line, such as a setting written as an
+    expression, is skipped with a warning, as loadOBJ does. Returns (freqs, times) arrays."""
+    settings = {"tempo": 120.0, "resolution": 96.0}
+    numbers = []
+    ticks = []
+    bad_lines = 0
+    with open(filename, "r") as score:
+        for number, line in enumerate(score, 1):
+            code = line.split("#")[0]
+            try:
+                setting = SETTING.match(line)
+                if setting:
+                    settings[setting.group(1)] = float(setting.group(2))
+                    continue
+                # what is left once the notes and the list around them are taken out should be blank
+                if NOTE.sub("", NOTES_START.sub("", code)).strip(" \t\r\n,[]"):
+                    raise ValueError("not a tempo or resolution setting or a list of notes")
+            except ValueError as e:
+                bad_lines += 1
+                if bad_lines <= max_warnings:
+                    print "Warning: skipping line %d of %s (%s): %s" % (number, filename, e, line.strip())
+                continue
+            for note, tick in NOTE.findall(code):
+                if tick == "None":
+                    continue
+                numbers.append(np.nan if note == "None" else float(note))
+                ticks.append(float(tick))
+    if bad_lines > max_warnings:
+        print "Warning: skipped %d unrecognised lines in %s" % (bad_lines, filename)
+    divisor = settings["resolution"] * settings["tempo"] / 60.0
+    return notenumbertofreq(numbers), np.array(ticks, dtype=np.float64) / divisor
+
+def readVarLen(data, pos):
+    """Read a MIDI variable-length quantity. Returns the value and the position after it."""
+    value = 0
+    while True:
+        byte = ord(data[pos])
+        pos += 1
+        value = (value << 7) | (byte & 0x7f)
+        if not byte & 0x80:
+            return value, pos
+
+def readTrackEvents(data):
+    """Pull the note-ons, note-offs and tempo changes out of one MTrk chunk.
+
+    Returns lists of (tick, note number) note-ons, the ticks of note-offs, (tick, microseconds per beat)
+    tempo changes, and the tick the track ends at."""
+    notes = []
+    offs = []
+    tempos = []
+    pos = 0
+    tick = 0
+    status = 0
+    while pos < len(data):
+        delta, pos = readVarLen(data, pos)
+        tick += delta
+        if ord(data[pos]) & 0x80:
+            status = ord(data[pos])
+            pos += 1
+        elif status == 0:
+            raise Exception("MIDI data byte without a status byte.")
+        if status == 0xff:
+            kind = ord(data[pos])
+            length, pos = readVarLen(data, pos + 1)
+            if kind == 0x51 and length == 3:
+                tempos.append((tick, struct.unpack(">I", "\0" + data[pos:pos + 3])[0]))
+            elif kind == 0x2f:
+                break
+            pos += length
+            status = 0  # meta events cancel running status
+        elif status in (0xf0, 0xf7):
+            length, pos = readVarLen(data, pos)
+            pos += length
+            status = 0
+        else:
+            kind = status & 0xf0
+            size = 1 if kind in (0xc0, 0xd0) else 2
+            args = [ord(b) for b in data[pos:pos + size]]
+            pos += size
+            if kind == 0x90 and args[1] > 0:
+                notes.append((tick, args[0]))
+            elif kind == 0x80 or kind == 0x90:
+                offs.append(tick)
+    return notes, offs, tempos, tick
+
+def parseMIDI(filename, track=None):
+    """Read the notes of one track of a Standard MIDI File, following its tempo changes.
+
+    With no track given, the first track that has any notes is used. Notes that start together are
+    reduced to the highest one, and the score ends when the last note stops. Returns (freqs, times) arrays."""
+    with open(filename, "rb") as midi:
+        data = midi.read()
+    if data[:4] != "MThd":
+        raise Exception(filename + " is not a MIDI file.")
+    header_length, _, num_tracks, division = struct.unpack(">IHHH", data[4:14])
+    pos = 8 + header_length
+    tracks = []
+    while pos + 8 <= len(data) and len(tracks) < num_tracks:
+        kind, length = struct.unpack(">4sI", data[pos:pos + 8])
+        if kind == "MTrk":
+            tracks.append(readTrackEvents(data[pos + 8:pos + 8 + length]))
+        pos += 8 + length
+    if track is None:
+        track = next((i for i, events in enumerate(tracks) if events[0]), None)
+        if track is None:
+            raise Exception(filename + " has no notes.")
+    elif not 0 <= track < len(tracks):
+        raise Exception("%s has no track %d." % (filename, track))
+    notes, offs, _, track_end = tracks[track]
+    if not notes:
+        raise Exception("Track %d of %s has no notes." % (track, filename))
+
+    # the highest of any notes that start on the same tick
+    notes = sorted(notes, key=lambda note: (note[0], -note[1]))
+    ticks, numbers = np.array(notes, dtype=np.float64).T
+    first = np.concatenate(([True], ticks[1:] != ticks[:-1]))
+    ticks, numbers = ticks[first], numbers[first]
+    end = max(offs + [ticks[-1]]) if offs else track_end
+    ticks = np.append(ticks, end)
+    numbers = np.append(numbers, np.nan)
+
+    if division & 0x8000:
+        # SMPTE timing: frames per second and ticks per frame
+        frames_per_second = 256 - (division >> 8)
+        return notenumbertofreq(numbers), ticks / float(frames_per_second * (division & 0xff))
+    # Tempo changes can be in any track, but usually live in the first
+    tempos = sorted(set(tempo for events in tracks for tempo in events[2]))
+    change_ticks = np.array([0.0] + [tick for tick, beat in tempos if tick > 0], dtype=np.float64)
+    beat_lengths = [500000] + [beat for tick, beat in tempos if tick > 0]
+    if tempos and tempos[0][0] == 0:
+        beat_lengths[0] = [beat for tick, beat in tempos if tick == 0][-1]
+    seconds_per_tick = np.array(beat_lengths, dtype=np.float64) / 1e6 / division
+    change_times = np.concatenate(([0.0], np.cumsum(np.diff(change_ticks) * seconds_per_tick[:-1])))
+    segment = np.searchsorted(change_ticks, ticks, side="right") - 1
+    times = change_times[segment] + (ticks - change_ticks[segment]) * seconds_per_tick[segment]
+    return notenumbertofreq(numbers), times
+
+def loadScore(filename, track=None, use_cache=True):
+    """Read a .uss score or a .mid file as (freqs, times) arrays, going through its compiled sidecar cache where possible."""
+    midi = filename.lower().endswith((".mid", ".midi"))
+    key = None
+    if use_cache:
+        key = cache.sourceKey(filename)
+        key["track"] = track
+        score = cache.load(filename, key)
+        if score is not None and "freqs" in score and "times" in score:
+            return np.array(score["freqs"]), np.array(score["times"])
+    freqs, times = parseMIDI(filename, track) if midi else parseUSS(filename)
+    if use_cache:
+        try:
+            cache.save(filename, {"freqs": freqs, "times": times}, key)
+        except (IOError, OSError) as e:
+            print "Warning: could not write score cache for %s: %s" % (filename, e)
+    return freqs, times
 
 
 class USSReader:
-    def __init__(self, filename):
-        parsed = {}
-        with open(filename) as f:
-            code = compile(f.read(), filename, "exec")
-            exec(code, parsed)
-        resolution = int(parsed["resolution"]) if "resolution" in parsed else 96
-        bps = (int(parsed["tempo"]) if "tempo" in parsed else 120) / 60
-        divisor = float(resolution * bps)
-        notes = (((self.notenumbertofreq(i[0]) if i[0] is not None else None), i[1]) for i in parsed["notes"])
-        self.notes = [(x[0], (float(x[1]) / divisor if x[1] is not None else None)) for x in notes]
+    """Reads a score from a .uss or .mid file. The notes are in freqs and times, and in notes as
+    (frequency, time) pairs with None for the frequency of the note that ends the score."""
+
+    def __init__(self, filename, track=None, use_cache=True):
+        self.freqs, self.times = loadScore(filename, track, use_cache)
+        self.notes = [(None if np.isnan(freq) else freq, time) for freq, time in zip(self.freqs.tolist(),
+                                                                                     self.times.tolist())]
 
     def notenumbertofreq(self, notenum):
-        #https://en.wikipedia.org/wiki/MIDI_Tuning_Standard
-        return (2.0**((notenum-69)/12.0)) * 440.0
+        return float(notenumbertofreq(notenum))
@@ -1,24 +1,377 @@
-import itertools
+import collections
+import hashlib
 import struct
+import threading
+import socket
+import Queue
 import math
+import time
 import wave
+import sys
+import os
+from multiprocessing.pool import ThreadPool
+
+import beampath as bp
+
+import warnings
+with warnings.catch_warnings():  # pypy's experimental version of numpy always screams at you
+    warnings.simplefilter("ignore")
+    import numpy as np
+
+
+def search_allocation(lengths, budget):
+    """Allocate samples by nudging a rounding offset until the edges fit in the budget.
+
+    This is the original allocator. It may leave a varying number of samples unused."""
+    lengths = np.asarray(lengths, dtype=np.float64)
+    total = lengths.sum()
+    if total <= 0:
+        return np.zeros(len(lengths), dtype=np.int64)
+    drawspeed = total / budget
+    offset = -0.1
+    step = 0.01
+    while True:
+        samples = np.array([int(round((length / drawspeed) - offset)) for length in lengths], dtype=np.int64)
+        if samples.sum() <= budget:
+            break
+        offset += step
+    # an edge given n samples used to be drawn with n - 1 of them
+    return np.maximum(samples - 1, 0)
+
+def proportional_allocation(lengths, budget):
+    """Allocate samples in proportion to edge length, using the largest remainder method
+    so that the counts always add up to exactly the budget."""
+    lengths = np.asarray(lengths, dtype=np.float64)
+    total = lengths.sum()
+    if total <= 0 or budget <= 0:
+        return np.zeros(len(lengths), dtype=np.int64)
+    quotas = lengths * (budget / total)
+    counts = np.floor(quotas).astype(np.int64)
+    remainder = int(budget - counts.sum())
+    if remainder > 0:
+        # stable sort so that ties go to the earlier edge
+        counts[np.argsort(counts - quotas, kind="mergesort")[:remainder]] += 1
+    return counts
+
+def snap_segments(vecs, quantum=1e-6):
+    """Snap the endpoints of an (E, 2, 2) array of line segments to a grid of quantum.
+
+    Edges that differ by less than quantum, such as the same frame projected along a slightly
+    different path, come out exactly the same and so render to exactly the same samples."""
+    return np.round(np.asarray(vecs, dtype=np.float64).reshape(-1, 2, 2) / quantum) * quantum
+
+def unique_segments(vecs, quantum=1e-6):
+    """Drop repeats from an (E, 2, 2) array of line segments, keeping the first of each in its own direction.
+
+    Endpoints are snapped to a grid of quantum before comparing, and a segment matches its own reverse."""
+    if len(vecs) < 2:
+        return vecs
+    ends = np.round(vecs / quantum).astype(np.int64)
+    # put the lesser endpoint first so that a segment and its reverse have the same key
+    swap = (ends[:, 0, 0] > ends[:, 1, 0]) | ((ends[:, 0, 0] == ends[:, 1, 0]) & (ends[:, 0, 1] > ends[:, 1, 1]))
+    ends[swap] = ends[swap, ::-1]
+    keys = ends.reshape(-1, 4)
+    # a stable sort on all four coordinates puts the first of each group of repeats at its head
+    order = np.lexsort(keys.T[::-1])
+    keys = keys[order]
+    heads = np.concatenate(([True], (keys[1:] != keys[:-1]).any(axis=1)))
+    if heads.all():
+        return vecs
+    return vecs[np.sort(order[heads])]
+
+def clip_segments(vecs, low, high):
+    """Clip an (E, 2, 2) array of line segments to the square from (low, low) to (high, high), Liang-Barsky style.
+
+    Segments entirely outside or with non-finite ends are dropped, and endpoints already inside are left
+    exactly as they were."""
+    with np.errstate(invalid="ignore"):
+        inside = ((vecs >= low) & (vecs <= high)).all(axis=(1, 2))
+    if inside.all():
+        return vecs
+    crossing = vecs[~inside]
+    start = crossing[:, 0].copy()
+    delta = crossing[:, 1] - start
+    # the four edges of the square, as p * t <= q for t in [0, 1] along each segment
+    p = np.concatenate((-delta, delta), axis=1)
+    q = np.concatenate((start - low, high - start), axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = q / p
+        t0 = np.maximum(np.where(p < 0, ratios, -np.inf).max(axis=1), 0.0)
+        t1 = np.minimum(np.where(p > 0, ratios, np.inf).min(axis=1), 1.0)
+        keep = (t0 <= t1) & ~((p == 0) & (q < 0)).any(axis=1) & np.isfinite(crossing).all(axis=(1, 2))
+    moved = t0 > 0
+    crossing[moved, 0] = start[moved] + t0[moved, np.newaxis] * delta[moved]
+    moved = t1 < 1
+    crossing[moved, 1] = start[moved] + t1[moved, np.newaxis] * delta[moved]
+    clipped = vecs.copy()
+    clipped[~inside] = crossing
+    inside[~inside] = keep
+    return clipped[inside]
+
+class MinimumAllocation:
+    """Give every edge at least min_samples samples and share out the rest in proportion to length.
+
+    Falls back to plain proportional allocation when the budget cannot cover the minimum."""
+
+    def __init__(self, min_samples=2):
+        self.min_samples = min_samples
+
+    def __call__(self, lengths, budget):
+        floor = self.min_samples * len(lengths)
+        if floor > budget:
+            return proportional_allocation(lengths, budget)
+        return self.min_samples + proportional_allocation(lengths, budget - floor)
+
+
+def synthesize_slice(vecs, counts, out, fits):
+    """Draw each of vecs with counts samples into the (sum(counts), 2) int16 array out.
+
+    Samples evenly spaced from just after each start point up to its end point are rounded half away
+    from zero like the builtin round(). Samples that struct.pack('h', ...) would have refused are
+    marked False in fits, and left for the caller to drop."""
+    total = len(out)
+    # index of the vector each sample belongs to, and its step number along that vector
+    owner = np.repeat(np.arange(len(counts)), counts)
+    steps = np.arange(1, total + 1, dtype=np.float64)
+    steps -= np.repeat(np.cumsum(counts) - counts, counts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        normals = (vecs[:, 1] - vecs[:, 0]) / counts[:, np.newaxis]
+    points = vecs[owner, 0] + normals[owner] * steps[:, np.newaxis]
+    points = np.copysign(np.floor(np.abs(points) + 0.5), points)
+    with np.errstate(invalid="ignore"):
+        fits[:] = ((points >= -32768) & (points <= 32767)).all(axis=1)
+    out[fits] = points[fits]
+
+
+class FrameCache:
+    """Remembers the samples of recently rendered frames, so that a frame seen before is not rendered again.
+
+    Frames are keyed by a hash of their edges, along with the sample budget and viewport size, so the
+    edges should be snapped (see snap_segments) and then rendered exactly as hashed. The least recently
+    used frames are forgotten once the samples stored add up to more than max_bytes."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.frames = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, vecs, budget, size):
+        digest = hashlib.sha1(np.ascontiguousarray(vecs, dtype=np.float64).tostring())
+        digest.update(struct.pack("<qd", budget, size))
+        return digest.digest()
+
+    def get(self, key):
+        frame = self.frames.pop(key, None)
+        if frame is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.frames[key] = frame  # now the most recently used
+        return frame
+
+    def put(self, key, frame):
+        if len(frame) > self.max_bytes:
+            return
+        self.frames[key] = frame
+        self.size += len(frame)
+        while self.size > self.max_bytes:
+            _, dropped = self.frames.popitem(last=False)
+            self.size -= len(dropped)
+
+    def clear(self):
+        self.frames.clear()
+        self.size = 0
+
+
+class BackgroundWriter(threading.Thread):
+    """Writes filled buffers out on its own thread, handing each buffer back once it is written.
+
+    There are only num_buffers buffers, so a producer that gets too far ahead waits for the disk."""
+
+    def __init__(self, write, buffer_size, num_buffers=3):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.write = write
+        self.pending = Queue.Queue()
+        self.free = Queue.Queue()
+        for _ in xrange(num_buffers - 1):
+            self.free.put(bytearray(buffer_size))
+        self.error = None
+        self.start()
+
+    def run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                self.pending.task_done()
+                return
+            buf, length = item
+            if self.error is None:
+                try:
+                    self.write(memoryview(buf)[:length])
+                except Exception as e:
+                    self.error = e
+            self.free.put(buf)
+            self.pending.task_done()
+
+    def submit(self, buf, length):
+        """Queue a buffer for writing and return an empty one to fill next."""
+        self.check()
+        self.pending.put((buf, length))
+        return self.free.get()
+
+    def wait(self):
+        """Block until every queued buffer has been written."""
+        self.pending.join()
+        self.check()
+
+    def finish(self):
+        """Write everything still queued and stop the thread."""
+        self.pending.put(None)
+        self.join()
+        self.check()
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+
+class StreamWriter(BackgroundWriter):
+    """A BackgroundWriter that sends buffers out at the rate they play, instead of as fast as it can.
+
+    Nothing goes out until the producer has num_buffers buffers queued (or has finished, or asks for a
+    flush), and the clock starts from there. Each buffer then goes out lead seconds before it is due to
+    play, by default the length of all num_buffers buffers, so the receiver never holds much more than
+    that and the producer can render up to num_buffers buffers ahead. A buffer that isn't ready by the
+    time it is due is an underrun: the receiver has run dry, and the clock restarts from there."""
+
+    def __init__(self, write, buffer_size, num_buffers=4, rate=192000, bytes_per_sample=4, lead=None):
+        self.bytes_per_second = float(rate * bytes_per_sample)
+        self.num_buffers = num_buffers
+        self.lead = lead if lead is not None else num_buffers * buffer_size / self.bytes_per_second
+        self.due = None
+        self.underruns = 0
+        self.dry_time = 0.0
+        BackgroundWriter.__init__(self, write, buffer_size, num_buffers)
+
+    def run(self):
+        primed = []
+        while len(primed) < self.num_buffers and (not primed or primed[-1] not in (None, "flush")):
+            primed.append(self.pending.get())
+        while True:
+            item = primed.pop(0) if primed else self.pending.get()
+            if item is None:
+                self.pending.task_done()
+                return
+            if item == "flush":
+                self.pending.task_done()
+                continue
+            buf, length = item
+            now = time.time()
+            if self.due is None:
+                self.due = now
+            elif now > self.due:
+                self.underruns += 1
+                self.dry_time += now - self.due
+                self.due = now
+            elif self.due - self.lead > now:
+                time.sleep(self.due - self.lead - now)
+            if self.error is None:
+                try:
+                    self.write(memoryview(buf)[:length])
+                except Exception as e:
+                    self.error = e
+            self.due += length / self.bytes_per_second
+            self.free.put(buf)
+            self.pending.task_done()
+
+    def wait(self):
+        """Block until every queued buffer has been written, starting the stream if it hasn't started yet."""
+        self.pending.put("flush")
+        BackgroundWriter.wait(self)
+
+
+class SocketSink:
+    """A file-like wrapper for a connected TCP or UDP socket. UDP writes are split into packets of packet_size bytes."""
+
+    def __init__(self, sock, packet_size=None):
+        self.sock = sock
+        self.packet_size = packet_size
+
+    def write(self, data):
+        data = memoryview(data).tobytes()
+        if self.packet_size is None:
+            self.sock.sendall(data)
+        else:
+            for start in xrange(0, len(data), self.packet_size):
+                self.sock.send(data[start:start + self.packet_size])
+
+    def close(self):
+        self.sock.close()
+
+
+def open_sink(target):
+    """Open a streaming target: "-" for stdout, "pipe:PATH" for a named pipe (made if missing),
+    or "tcp://HOST:PORT" / "udp://HOST:PORT" for a local socket.
+
+    Anything else printed to stdout ends up in a "-" stream; StreamOutput sends it to stderr instead."""
+    if target == "-":
+        return os.fdopen(os.dup(sys.stdout.fileno()), "wb", 0)
+    if target.startswith("pipe:"):
+        path = target[len("pipe:"):]
+        if not os.path.exists(path):
+            os.mkfifo(path)
+        return open(path, "wb", 0)
+    for scheme, kind in (("tcp://", socket.SOCK_STREAM), ("udp://", socket.SOCK_DGRAM)):
+        if target.startswith(scheme):
+            host, port = target[len(scheme):].rsplit(":", 1)
+            sock = socket.socket(socket.AF_INET, kind)
+            sock.connect((host, int(port)))
+            return SocketSink(sock, 1024 if kind == socket.SOCK_DGRAM else None)
+    raise Exception("Unknown stream target " + target + ".")
+
+def is_stream_target(target):
+    return target == "-" or target.startswith("pipe:") or target.startswith("tcp://") or target.startswith("udp://")
+
+def open_output(target, fps, **kwargs):
+    """A StreamOutput for a streaming target (see open_sink), or a WavOutput for anything else."""
+    if isinstance(target, basestring) and is_stream_target(target):
+        kwargs.pop("background", None)
+        return StreamOutput(target, fps, **kwargs)
+    return WavOutput(target, fps, **kwargs)
 
 
 class WavOutput:
     """Outputs a list of vectors to a wav file."""
 
-    def __init__(self, filename, fps, rate=192000):
+    def __init__(self, filename, fps, rate=192000, allocator=proportional_allocation, planner=None,
+                 chunk_size=1024 * 1024, background=False, frame_cache=None, synth_threads=1,
+                 parallel_threshold=1 << 18):
         self.wavrange = 32766
-        self.chunk_size = 1024 * 1024 # 1 MB
-        self.wavbuffer = []
+        self.synth_threads = synth_threads  # threads to synthesize a frame of at least parallel_threshold samples
+        self.parallel_threshold = parallel_threshold
+        self.synth_pool = None
+        self.frame_cache = frame_cache  # a FrameCache to reuse the samples of repeated frames
+        self.allocator = allocator
+        self.planner = planner if planner is not None else bp.BeamPathPlanner()
+        self.chunk_size = chunk_size  # bytes buffered before a flush
+        self.wavbuffer = bytearray(chunk_size)
+        self.buffered = 0
         self.samples_per_frame = rate / fps
         self.samplerate = rate
-        self.raw = filename.endswith(".raw")
-        if self.raw:
+        # filename may also be an open file-like object, which is written raw
+        self.raw = hasattr(filename, "write") or filename.endswith(".raw")
+        if hasattr(filename, "write"):
+            self.audio_out = filename
+        elif self.raw:
             self.audio_out = open(filename, "wb")
         else:
             self.audio_out = wave.open(filename, "w")
             self.audio_out.setparams((2, 2, rate, 0, 'NONE', 'not compressed'))
+        self.writer = BackgroundWriter(self.write_out, chunk_size) if background else None
+        self.profiler = None  # a profiler.Profiler to time and count the work done per frame
 
     def setfps(self, value):
         self.samples_per_frame = self.samplerate / value
@@ -27,74 +380,163 @@ class WavOutput:
         """Get distance between two 2D points."""
         return math.sqrt((p0[0] - p1[0])**2 + (p0[1] - p1[1])**2)
 
-    def valid_vecs(self, vecs, size):
-        """Returns only non-duplicate vectors, shrunken to within wavrange"""
-        results = set()
-        shrunken = set()
-        for vec in vecs:
-            if (vec not in results) and (vec[::-1] not in results):
-                results.add(vec)
-                if abs(vec[0][0]) > size or abs(vec[0][1]) > size or abs(vec[1][0]) > size or abs(vec[1][1]) > size:
-                    continue
-                shrunken.add(((((vec[0][0] / size) * self.wavrange * 2) - self.wavrange, ((vec[0][1] / size) * self.wavrange * 2) - self.wavrange), (((vec[1][0] / size) * self.wavrange * 2) - self.wavrange, ((vec[1][1] / size) * self.wavrange * 2) - self.wavrange)))
-        return shrunken
+    def valid_vecs(self, vecs, size, quantum=1e-6):
+        """Returns the distinct vectors, clipped to the size by size viewport and scaled to within wavrange,
+        in their original order, as an (E, 2, 2) array.
+
+        Vectors are the same if their endpoints match to within quantum, whichever way round they go."""
+        vecs = unique_segments(np.asarray(vecs, dtype=np.float64).reshape(-1, 2, 2), quantum)
+        vecs = clip_segments(vecs, 0, size)
+        return ((vecs / size) * self.wavrange * 2) - self.wavrange
+
+    def write_out(self, data):
+        if self.raw:
+            self.audio_out.write(data)
+        else:
+            self.audio_out.writeframes(data)
 
     def buffer_wav(self, chunk):
+        """Add a chunk of sample bytes to the output, or finish the file if chunk is None."""
         if chunk is None:
-            if self.raw:
-                self.audio_out.write("".join(self.wavbuffer))
-            else:
-                self.audio_out.writeframes("".join(self.wavbuffer))
-            self.audio_out.close()
-            del self.wavbuffer[:]
+            self.close()
             return
-        self.wavbuffer.append(chunk)
-        if len(self.wavbuffer) > self.chunk_size:
-            if self.raw:
-                self.audio_out.write("".join(self.wavbuffer))
+        view = memoryview(chunk)
+        while len(view):
+            space = self.chunk_size - self.buffered
+            taken = min(space, len(view))
+            self.wavbuffer[self.buffered:self.buffered + taken] = view[:taken]
+            self.buffered += taken
+            view = view[taken:]
+            if self.buffered == self.chunk_size:
+                self.flush()
+
+    def flush(self, wait=False):
+        """Write out everything buffered so far, on the background writer if there is one.
+
+        With wait=True, don't return until the background writer has caught up."""
+        profiler = self.profiler
+        if profiler:
+            start = profiler.clock()
+            profiler.count("bytes_flushed", self.buffered)
+        if self.buffered:
+            if self.writer:
+                self.wavbuffer = self.writer.submit(self.wavbuffer, self.buffered)
             else:
-                self.audio_out.writeframes("".join(self.wavbuffer))
-            del self.wavbuffer[:]  # insta-clear with GC
-
-    def add_sample(self, vec):
-        try:
-            left = struct.pack('h', int(round(vec[0])))
-            right = struct.pack('h', int(round(vec[1])))
-            self.buffer_wav(left)
-            self.buffer_wav(right)
-        except:
-            pass
+                self.write_out(memoryview(self.wavbuffer)[:self.buffered])
+            self.buffered = 0
+        if wait and self.writer:
+            self.writer.wait()
+        if profiler:
+            profiler.add("audio.flush", start)
+
+    def close(self):
+        """Flush the buffer, wait for any pending writes and close the file."""
+        if self.synth_pool is not None:
+            self.synth_pool.close()
+            self.synth_pool = None
+        self.flush()
+        if self.writer:
+            self.writer.finish()
+            self.writer = None
+        self.audio_out.close()
 
     def wavify(self, unsorted_vecs, size):
-        vecs = self.valid_vecs(unsorted_vecs, size)
-        distances = {}
-        for vec in vecs:
-            distances[vec] = self.distance(vec[0], vec[1])
-        drawspeed = sum(distances.itervalues()) / self.samples_per_frame
-        offset = -0.1
-        step = 0.01
-        samples = {}
-        while True:
-            samples_left = int(self.samples_per_frame)
-            for vec in vecs:
-                start = vec[0]
-                end = vec[1]
-                vec_samples = int(round((distances[vec] / drawspeed) - offset))
-                samples[vec] = vec_samples
-                samples_left -= vec_samples
-            if samples_left >= 0:
-                break
-            samples = {}
-            offset += step
-        keys = samples.keys()
-        keys.sort(key=lambda pt: ((pt[0][0] + pt[1][0]) / 2, (pt[0][1] + pt[1][1]) / 2))
-        for vec, vec_samples in itertools.izip(keys, itertools.imap(samples.get, keys)):
-            pos = list(vec[0])
-            dist = distances[vec]
-            normal = ((vec[1][0] - vec[0][0]) / (vec_samples - 1), (vec[1][1] - vec[0][1]) / (vec_samples - 1))
-            for i in xrange(vec_samples - 1):
-                pos[0] += normal[0]
-                pos[1] += normal[1]
-                self.add_sample(pos)
-        for _ in range(samples_left):
-            self.add_sample((0,0))
\ No newline at end of file
+        profiler = self.profiler
+        if profiler:
+            start = profiler.clock()
+        budget = int(self.samples_per_frame)
+        # snapped whether or not there is a cache, so that a cached frame is always the one a fresh render gives
+        snapped = snap_segments(unsorted_vecs)
+        if self.frame_cache is not None:
+            key = self.frame_cache.key(snapped, budget, size)
+            frame = self.frame_cache.get(key)
+            if profiler:
+                start = profiler.add("audio.frame_cache", start)
+                profiler.count("frame_cache_hits" if frame is not None else "frame_cache_misses")
+            if frame is not None:
+                self.buffer_wav(frame)
+                return
+        vecs = self.valid_vecs(snapped, size)
+        if profiler:
+            start = profiler.add("audio.valid_vecs", start)
+            profiler.count("edges_in", len(unsorted_vecs))
+            profiler.count("edges_kept", len(vecs))
+        vecs = self.planner.plan(vecs)
+        if profiler:
+            start = profiler.add("audio.plan", start)
+            profiler.count("jump_distance", self.planner.last_jump_distance)
+            if self.planner.last_cached:
+                profiler.count("plan_cache_hits")
+        lengths = np.sqrt(((vecs[:, 1] - vecs[:, 0]) ** 2).sum(axis=1))
+        counts = self.allocator(lengths, budget)
+        padding = budget - int(sum(counts))
+        if profiler:
+            start = profiler.add("audio.allocate", start)
+        frame = self.synthesize(vecs, counts, padding)
+        if profiler:
+            profiler.add("audio.synthesize", start)
+            profiler.count("samples", len(frame) // 4 - padding)
+            profiler.count("padding_samples", padding)
+        if self.frame_cache is not None:
+            self.frame_cache.put(key, frame)
+        self.buffer_wav(frame)
+
+    def synthesize(self, vecs, counts, padding=0):
+        """Build a whole frame of interleaved 16-bit L/R samples in one go.
+
+        Each vector vecs[i] is drawn with counts[i] samples evenly spaced from just after
+        its start point up to its end point, followed by padding samples of (0,0).
+        Frames of at least parallel_threshold samples are split between synth_threads threads."""
+        vecs = np.asarray(vecs, dtype=np.float64).reshape(-1, 2, 2)
+        counts = np.maximum(np.asarray(counts, dtype=np.int64).reshape(-1), 0)
+        total = int(counts.sum())
+        frame = np.zeros((total + max(int(padding), 0), 2), dtype=np.int16)
+        fits = np.ones(total, dtype=bool)
+        if self.synth_threads > 1 and total >= self.parallel_threshold and len(counts) > 1:
+            # contiguous runs of vectors with about the same number of samples each,
+            # writing to their own stretch of the frame
+            ends = np.cumsum(counts)
+            targets = total * np.arange(1, self.synth_threads) // self.synth_threads
+            cuts = np.unique(np.concatenate(([0], np.searchsorted(ends, targets, side="right"), [len(counts)])))
+            offsets = np.concatenate(([0], ends))[cuts]
+            if self.synth_pool is None:
+                self.synth_pool = ThreadPool(self.synth_threads)
+            self.synth_pool.map(lambda i: synthesize_slice(vecs[cuts[i]:cuts[i + 1]], counts[cuts[i]:cuts[i + 1]],
+                                                           frame[offsets[i]:offsets[i + 1]],
+                                                           fits[offsets[i]:offsets[i + 1]]),
+                                range(len(cuts) - 1))
+        elif total:
+            synthesize_slice(vecs, counts, frame[:total], fits)
+        if not fits.all():
+            frame = np.concatenate((frame[:total][fits], frame[total:]))
+        return frame.tostring()
+
+
+class StreamOutput(WavOutput):
+    """Streams interleaved 16-bit stereo PCM live to stdout, a named pipe or a socket instead of writing a file.
+
+    The defaults match the bufferSize and numBuffers in the oscilloscope's data/settings.txt:
+    1024-sample buffers, rendered at most 4 buffers ahead of playback."""
+
+    def __init__(self, target, fps, rate=192000, allocator=proportional_allocation, planner=None,
+                 buffer_samples=1024, num_buffers=4, lead=None, frame_cache=None):
+        WavOutput.__init__(self, open_sink(target), fps, rate, allocator, planner, chunk_size=buffer_samples * 4,
+                           frame_cache=frame_cache)
+        self.real_stdout = None
+        if target == "-":
+            # keep progress messages out of the sample stream until it is closed
+            self.real_stdout, sys.stdout = sys.stdout, sys.stderr
+        self.writer = StreamWriter(self.write_out, self.chunk_size, num_buffers, rate, lead=lead)
+
+    @property
+    def underruns(self):
+        return self.writer.underruns if self.writer else self.final_underruns
+
+    def close(self):
+        writer = self.writer
+        WavOutput.close(self)
+        self.final_underruns = writer.underruns if writer else 0
+        if self.final_underruns:
+            print "Warning: the stream ran dry %d times, for %.3f seconds in all." % (writer.underruns, writer.dry_time)
+        if self.real_stdout is not None:
+            sys.stdout, self.real_stdout = self.real_stdout, None
@@ -2,6 +2,7 @@ import warnings
 with warnings.catch_warnings():  # pypy's experimental version of numpy always screams at you
     warnings.simplefilter("ignore")
     import numpy as np
+import lod
 
 def translationMatrix(dx=0, dy=0, dz=0):
     """ Return matrix for translation along vector (dx, dy, dz). """
@@ -76,42 +77,116 @@ def rotateAboutVector((cx,cy,cz), (x,y,z), radians):
     
     return matrix
 
+def boxCorners(points):
+    """ The 8 corners of the box around an (N, 3) array of points, as homogeneous (8, 4) rows. """
+
+    low = points.min(axis=0)
+    high = points.max(axis=0)
+    return np.array([[x, y, z, 1] for x in (low[0], high[0]) for y in (low[1], high[1]) for z in (low[2], high[2])])
+
 class Wireframe:
-    """ An array of vectors in R3 and list of edges connecting them. """
+    """ An array of vectors in R3 and list of edges connecting them.
+
+        In compact mode the nodes are float32 rows at the start of a preallocated buffer, transforms
+        write into a second buffer and swap the two, and the bounding box is carried through translations,
+        axis-aligned scalings and axis swaps instead of being rescanned. The box around rotated nodes can't be
+        found from the old box, so a rotation drops it and the next bounds() or findCenter() scans the nodes
+        once. An array taken from self.nodes is only valid until the next transform; copy it to keep it. """
     
-    def __init__(self, nodes=None):
-        self.nodes = np.zeros((0,4))
-        self.edges = []
+    def __init__(self, nodes=None, compact=False):
+        self.compact = compact
+        self.nodes = np.zeros((0,4), dtype=np.float32 if compact else np.float64)
+        self.node_buffer = None
+        self.scratch = None
+        self.corners = None  # the compact-mode bounding box, or None if it has to be found again
+        self.edges = np.zeros((0,2), dtype=np.int32)
         self.faces = []
+        self.lod = None
+        self.pack = None  # the PackedScene whose node array self.nodes is a view of, if any
         if nodes is not None:
             self.addNodes(nodes)
 
 
+    def makeCompact(self):
+        """ Switch to compact float32 storage. """
+
+        self.compact = True
+        self.adoptNodes()
+
+    def adoptNodes(self, capacity=16):
+        """ In compact mode, move the nodes into the node buffer if they have been replaced from outside. """
+
+        if self.node_buffer is not None and self.nodes.base is self.node_buffer:
+            return
+        nodes = np.asarray(self.nodes, dtype=np.float32).reshape(-1, 4)
+        capacity = max(capacity, len(nodes))
+        self.node_buffer = np.empty((capacity, 4), dtype=np.float32)
+        self.scratch = np.empty((capacity, 4), dtype=np.float32)
+        self.node_buffer[:len(nodes)] = nodes
+        self.nodes = self.node_buffer[:len(nodes)]
+        self.corners = None
+
     def addNodes(self, node_array):
         """ Append 1s to a list of 3-tuples and add to self.nodes. """
         moo = np.ones((len(node_array),1))
         ones_added = np.hstack((node_array, moo))
-        self.nodes = np.vstack((self.nodes, ones_added))
+        if not self.compact:
+            self.nodes = np.vstack((self.nodes, ones_added))
+            return
+        self.adoptNodes()
+        count = len(self.nodes)
+        total = count + len(ones_added)
+        if total > len(self.node_buffer):
+            # grow by doubling, so appending one node at a time stays cheap
+            old = self.nodes
+            self.node_buffer = np.empty((2 * total, 4), dtype=np.float32)
+            self.scratch = np.empty((2 * total, 4), dtype=np.float32)
+            self.node_buffer[:count] = old
+        self.node_buffer[count:total] = ones_added
+        self.nodes = self.node_buffer[:total]
+        if len(ones_added) and self.corners is not None:
+            self.corners = boxCorners(np.vstack((self.corners[:,:-1], ones_added[:,:-1])))
     
     def addEdges(self, edge_list):
-        """ Add edges as a list of 2-tuples. """
-        
-        # Is it better to use a for loop or generate a long list then add it?
-        # Should raise exception if edge value > len(self.nodes)
-        self.edges += [edge for edge in edge_list if edge not in self.edges]
+        """ Add edges as a list of 2-tuples or an (E, 2) array.
+
+            Edges are undirected, so (a, b) and (b, a) are the same edge and duplicates are dropped, as are
+            edges from a node to itself, such as those of a face with two corners on the same node. """
+
+        new_edges = np.sort(np.asarray(edge_list, dtype=np.int32).reshape(-1, 2), axis=1)
+        if len(new_edges) == 0:
+            return
+        if new_edges.min() < 0 or new_edges.max() >= len(self.nodes):
+            raise Exception("Edge refers to a node that does not exist.")
+        new_edges = new_edges[new_edges[:,0] != new_edges[:,1]]
+        edges = np.vstack((self.edges, new_edges))
+        # Pack each edge into one integer so duplicates can be found with a single sort
+        keys = (edges[:,0].astype(np.int64) << 32) | edges[:,1]
+        _, first = np.unique(keys, return_index=True)
+        self.edges = edges[np.sort(first)]
 
     def addFaces(self, face_list, face_colour=(255,255,255)):
+        """ Add faces as a list of node index sequences, or an (F, k) array of k-sided faces, along with their edges. """
+
+        colour = np.array(face_colour, np.uint8)
+        if isinstance(face_list, np.ndarray) and face_list.ndim == 2:
+            faces = face_list[(face_list < len(self.nodes)).all(axis=1)]
+            self.faces.extend((tuple(face), colour) for face in faces.tolist())
+            self.addEdges(np.dstack((np.roll(faces, 1, axis=1), faces)).reshape(-1, 2))
+            return
+        face_edges = []
         for node_list in face_list:
             num_nodes = len(node_list)
             if all((node < len(self.nodes) for node in node_list)):
                 #self.faces.append([self.nodes[node] for node in node_list])
-                self.faces.append((node_list, np.array(face_colour, np.uint8)))
-                self.addEdges([(node_list[n-1], node_list[n]) for n in range(num_nodes)])
+                self.faces.append((node_list, colour))
+                face_edges.extend((node_list[n-1], node_list[n]) for n in range(num_nodes))
+        self.addEdges(face_edges)
     
     def output(self):
         if len(self.nodes) > 1:
             self.outputNodes()
-        if self.edges:
+        if len(self.edges):
             self.outputEdges()
         if self.faces:
             self.outputFaces()  
@@ -134,15 +209,52 @@ class Wireframe:
     def transform(self, transformation_matrix):
         """ Apply a transformation defined by a transformation matrix. """
         
-        self.nodes = np.dot(self.nodes, transformation_matrix)
+        if self.pack is not None and self.nodes.base is self.pack.nodes:
+            self.nodes[:] = np.dot(self.nodes, transformation_matrix)
+            return
+        if not self.compact:
+            self.nodes = np.dot(self.nodes, transformation_matrix)
+            return
+        self.adoptNodes()
+        count = len(self.nodes)
+        np.dot(self.nodes, np.asarray(transformation_matrix, dtype=np.float32), out=self.scratch[:count])
+        self.node_buffer, self.scratch = self.scratch, self.node_buffer
+        self.nodes = self.node_buffer[:count]
+        if self.corners is not None:
+            # the box around the moved corners is the box around the moved nodes only when no axis is rotated
+            linear = np.asarray(transformation_matrix)[:3,:3] != 0
+            if (linear.sum(axis=0) == 1).all() and (linear.sum(axis=1) == 1).all():
+                self.corners = np.dot(self.corners, transformation_matrix)
+            else:
+                self.corners = None
+
+    def bounds(self):
+        """ The minimum and maximum x, y and z coordinates.
+
+            In compact mode the box is cached, and rescanned only on the first call after a rotation. """
+
+        if self.compact:
+            self.adoptNodes()
+            if self.corners is None and len(self.nodes):
+                self.corners = boxCorners(self.nodes[:,:-1].astype(np.float64))
+            if self.corners is not None:
+                return self.corners[:,:-1].min(axis=0), self.corners[:,:-1].max(axis=0)
+        return self.nodes[:,:-1].min(axis=0), self.nodes[:,:-1].max(axis=0)
     
     def findCenter(self):
-        """ Find the spatial centre by finding the range of the x, y and z coordinates. """
+        """ Find the spatial centre by finding the range of the x, y and z coordinates.
 
-        min_values = self.nodes[:,:-1].min(axis=0)
-        max_values = self.nodes[:,:-1].max(axis=0)
+            This is the centre of bounds(), so in compact mode it costs a scan only after a rotation. """
+
+        min_values, max_values = self.bounds()
         return 0.5*(min_values + max_values)
     
+    def buildLOD(self, ratio=0.5, min_edges=12):
+        """ Precompute coarser versions of this wireframe for drawing with fewer samples. """
+
+        self.lod = lod.LODPyramid.build(self, ratio, min_edges)
+        return self.lod
+
     def sortedFaces(self):
         return sorted(self.faces, key=lambda face: min(self.nodes[f][2] for f in face[0]))
     
@@ -150,11 +262,60 @@ class Wireframe:
         """ Override this function to control wireframe behaviour. """
         pass
 
+class PackedScene:
+    """ The nodes and edges of several wireframes packed into one node array and one edge array.
+
+        Each wireframe's nodes become a view of its rows of the packed array, so transforming the
+        wireframe on its own moves them in place. The packed edges are offset to index the packed nodes.
+        Wireframe i owns the nodes from node_starts[i] up to node_starts[i+1], and likewise for edges. """
+
+    def __init__(self, wireframes):
+        self.names = [name for name, _ in wireframes]
+        self.wireframes = [wireframe for _, wireframe in wireframes]
+        if any(wireframe.compact for wireframe in self.wireframes):
+            raise Exception("Compact wireframes cannot be packed.")
+        self.edge_arrays = [wireframe.edges for wireframe in self.wireframes]
+        self.node_starts = np.cumsum([0] + [len(wireframe.nodes) for wireframe in self.wireframes])
+        self.edge_starts = np.cumsum([0] + [len(edges) for edges in self.edge_arrays])
+        self.nodes = np.vstack([np.zeros((0,4))] + [wireframe.nodes for wireframe in self.wireframes])
+        self.edges = np.vstack([np.zeros((0,2), dtype=np.intp)] +
+                               [edges.astype(np.intp) + start for edges, start in zip(self.edge_arrays, self.node_starts)])
+        for i, wireframe in enumerate(self.wireframes):
+            wireframe.pack = self
+            wireframe.nodes = self.nodes[self.node_starts[i]:self.node_starts[i+1]]
+
+    def matches(self, wireframes):
+        """ Whether a dictionary of wireframes still has the same wireframes, node counts and edges as when packed. """
+
+        if len(wireframes) != len(self.names):
+            return False
+        for i, (name, wireframe) in enumerate(zip(self.names, self.wireframes)):
+            if wireframes.get(name) is not wireframe or wireframe.compact or wireframe.edges is not self.edge_arrays[i] \
+                    or len(wireframe.nodes) != self.node_starts[i+1] - self.node_starts[i]:
+                return False
+        return True
+
+    def adopt(self):
+        """ Copy in the nodes of any wireframe that has been given a new node array, such as by a restore. """
+
+        for i, wireframe in enumerate(self.wireframes):
+            if wireframe.nodes.base is not self.nodes:
+                rows = self.nodes[self.node_starts[i]:self.node_starts[i+1]]
+                rows[:] = wireframe.nodes
+                wireframe.nodes = rows
+
+    def transform(self, transformation_matrix):
+        self.nodes[:] = np.dot(self.nodes, transformation_matrix)
+
+    def bounds(self):
+        return self.nodes[:,:-1].min(axis=0), self.nodes[:,:-1].max(axis=0)
+
 class WireframeGroup:
     """ A dictionary of wireframes and methods to manipulate them all together. """
     
     def __init__(self):
         self.wireframes = {}
+        self.packed_scene = None
     
     def addWireframe(self, name, wireframe):
         self.wireframes[name] = wireframe
@@ -174,15 +335,42 @@ class WireframeGroup:
             print name
             wireframe.outputEdges()
     
+    def pack(self):
+        """ Pack the wireframes into one node array and one edge array, so that group transforms, bounds and
+            projection each take one call. The wireframes can still be transformed on their own. """
+
+        self.packed_scene = PackedScene(self.wireframes.items())
+        return self.packed_scene
+
+    def packedScene(self):
+        """ The PackedScene brought up to date with the wireframes, repacking if any were added, removed or
+            changed shape, or None if the group has not been packed. """
+
+        packed = self.packed_scene
+        if packed is None:
+            return None
+        if not packed.matches(self.wireframes):
+            return self.pack()
+        packed.adopt()
+        return packed
+    
     def findCenter(self):
         """ Find the central point of all the wireframes. """
         
-        # There may be a more efficient way to find the minimums for a group of wireframes
-        min_values = np.array([wireframe.nodes[:,:-1].min(axis=0) for wireframe in self.wireframes.values()]).min(axis=0)
-        max_values = np.array([wireframe.nodes[:,:-1].max(axis=0) for wireframe in self.wireframes.values()]).max(axis=0)
+        packed = self.packedScene()
+        if packed is not None:
+            min_values, max_values = packed.bounds()
+            return 0.5*(min_values + max_values)
+        bounds = [wireframe.bounds() for wireframe in self.wireframes.values()]
+        min_values = np.array([low for low, _ in bounds]).min(axis=0)
+        max_values = np.array([high for _, high in bounds]).max(axis=0)
         return 0.5*(min_values + max_values)
     
     def transform(self, matrix):
+        packed = self.packedScene()
+        if packed is not None:
+            packed.transform(matrix)
+            return
         for wireframe in self.wireframes.values():
             wireframe.transform(matrix)
 
@@ -2,10 +2,15 @@ import warnings
 with warnings.catch_warnings():  # pypy's experimental version of numpy always screams at you
     warnings.simplefilter("ignore")
     import numpy as np
+import scenegraph as sg
+import culling
+import profiler as prof
 import effects as fx
 import wireframe as wf
 import wavoutput as wav
 
+import bisect
+import copy
 import time
 import sys
 import os
@@ -24,6 +29,8 @@ class WireframeViewer(wf.WireframeGroup):
         self.total_time = run_time
         self.last_percent = 0.0
         self.has_run = False
+        self.frame = 0
+        self.elapsed = 0.0
 
         if show_view:
             import pygame
@@ -33,14 +40,16 @@ class WireframeViewer(wf.WireframeGroup):
 
         if filename:
             if fps:
-                self.wavout = wav.WavOutput(filename=filename, fps=fps)
+                self.wavout = wav.open_output(filename, fps, background=True)
             else:
-                self.wavout = wav.WavOutput(filename=filename, fps=60)
+                self.wavout = wav.open_output(filename, 60, background=True)
                 print "Warning: No FPS provided! Unless you're modifying it with an effect, please set the FPS on init."
         else:
             self.wavout = None
         
         self.wireframes = {}
+        self.packed_scene = None  # see pack
+        self.scene = sg.SceneGraph(self)
         self.effects = []
         self.object_to_update = []
         
@@ -48,10 +57,17 @@ class WireframeViewer(wf.WireframeGroup):
         self.eyeX = self.width/2
         self.eyeY = 100
         self.view_vector = np.array([0, 0, -1])
+        self.culling = None  # None, "backface" or "hidden"
+        self.cullers = {}
+        self.culled_edges = 0
+        self.block_culled_edges = []
+        self.lod_samples_per_edge = None  # set to draw at most one edge per this many samples
+        self.profiler = None  # see enableProfiling
         
         self.background = (0,0,0)
         self.nodeColour = (0,180,255)
         self.line_width = line_width
+        self.fps = fps
         self.fixed_dt = fps
         if self.fixed_dt is not None:
             self.fixed_dt = 1.0 / float(self.fixed_dt)
@@ -80,7 +96,7 @@ class WireframeViewer(wf.WireframeGroup):
         else:
             self.key_to_function = {}
 
-        self.frame_vectors = []
+        self.frame_edges = np.zeros((0, 2, 2))
 
     def addEffect(self, effect):
         """Add a new instance of a ScopeEffect derivative to the active effects"""
@@ -89,6 +105,13 @@ class WireframeViewer(wf.WireframeGroup):
         else:
             self.effects.append(effect)
 
+    def setfps(self, fps):
+        """Change the frame rate, keeping the audio output in step."""
+        self.fps = fps
+        self.fixed_dt = 1.0 / float(fps)
+        if self.wavout:
+            self.wavout.setfps(fps)
+
     def removeEffect(self, effect_class):
         to_delete = []
         for effect in self.effects:
@@ -135,35 +158,165 @@ class WireframeViewer(wf.WireframeGroup):
         rotation_matrix = np.dot(np.dot(translation_matrix1, rotation_matrix), translation_matrix2)
         self.transform(rotation_matrix)
 
+    def projectNodes(self, nodes):
+        """Project an (..., N, 4) node array onto the screen.
+
+        Returns the (..., N, 2) screen positions and a mask of which nodes are in front of the near plane."""
+        if not self.perspective:
+            return nodes[..., :2], np.ones(nodes.shape[:-1], dtype=bool)
+        center = np.array([self.width/2, self.height/2])
+        depth = nodes[..., 2]
+        in_front = depth > -self.perspective
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scale = self.perspective / (self.perspective + depth)
+        return center + scale[..., np.newaxis] * (nodes[..., :2] - center), in_front
+
+    def culler(self, wireframe):
+        """The FaceCuller for a wireframe, rebuilt if its faces or edges have changed, or None if it has no faces."""
+        if not wireframe.faces:
+            return None
+        key = (len(wireframe.faces), len(wireframe.edges))
+        cached = self.cullers.get(id(wireframe))
+        if cached is None or cached[0] != key or cached[1] is not wireframe:
+            cached = (key, wireframe, culling.FaceCuller(wireframe))
+            self.cullers[id(wireframe)] = cached
+        return cached[2]
+
+    def visibleEdges(self, wireframe, nodes, points):
+        """A mask of which of a wireframe's edges survive culling, given its world nodes and their projection."""
+        face_culler = self.culler(wireframe) if self.culling else None
+        if face_culler is None:
+            return np.ones(len(wireframe.edges), dtype=bool)
+        eye = (self.width/2, self.height/2, -self.perspective) if self.perspective else None
+        return face_culler.visibleEdges(nodes, eye, points, self.culling)
+
+    def edgeShares(self, budget):
+        """How many edges each wireframe may draw with a frame's sample budget, or an empty dict without LOD."""
+        if not self.lod_samples_per_edge or budget is None:
+            return {}
+        total = sum(len(wireframe.edges) for wireframe in self.wireframes.itervalues())
+        allowed = budget / float(self.lod_samples_per_edge)
+        return dict((name, allowed * len(wireframe.edges) / max(total, 1))
+                    for name, wireframe in self.wireframes.iteritems())
+
+    def drawnLevel(self, wireframe, max_edges):
+        """The level of detail of a wireframe to draw with at most max_edges edges, building its LOD pyramid if needed."""
+        if max_edges is None:
+            return wireframe
+        if wireframe.lod is None or wireframe.lod.levels[0].edges is not wireframe.edges:
+            wireframe.buildLOD()
+        return wireframe.lod.select(max_edges)
+
+    def projectLevel(self, level, nodes, points, in_front):
+        """Line segments for the edges of one level of a wireframe, and how many of them were culled."""
+        edges = np.asarray(level.edges, dtype=np.intp).reshape(-1, 2)
+        visible = self.visibleEdges(level, nodes, points)
+        edges = edges[visible & in_front[edges[:, 0]] & in_front[edges[:, 1]]]
+        return points[edges], len(visible) - np.count_nonzero(visible)
+
+    def project(self):
+        """Project every wireframe's edges onto the screen as an (E, 2, 2) array of line segments.
+
+        Each wireframe's nodes are projected once, and edges with an endpoint behind the near plane are dropped,
+        as are edges hidden by the wireframe's own faces if culling is turned on. With LOD turned on, each
+        wireframe is drawn at the level of detail that fits the current sample budget."""
+        segments = []
+        self.culled_edges = 0
+        shares = self.edgeShares(self.wavout.samples_per_frame if self.wavout else None)
+        packed = self.packedScene()
+        if packed is not None:
+            return self.projectPacked(packed, shares)
+        for name, wireframe in self.wireframes.iteritems():
+            nodes = self.scene.worldNodes(name)
+            points, in_front = self.projectNodes(nodes)
+            level = self.drawnLevel(wireframe, shares.get(name))
+            drawn, culled = self.projectLevel(level, nodes, points, in_front)
+            self.culled_edges += culled
+            segments.append(drawn)
+        if segments:
+            return np.concatenate(segments)
+        return np.zeros((0, 2, 2))
+
+    def projectAt(self, times, budgets=None):
+        """Project the scene as it is at each of an array of times, in one go per wireframe.
+
+        All motion must come from scene graph trajectories. Returns a list of (E, 2, 2) arrays, one per time,
+        and leaves the number of edges culled from each in block_culled_edges. Per-frame sample budgets
+        are needed to pick levels of detail."""
+        frames = [[] for _ in times]
+        self.block_culled_edges = [0] * len(times)
+        shares = [self.edgeShares(budget) for budget in budgets] if budgets is not None else [{}] * len(times)
+        packed = self.packedScene()
+        if packed is not None:
+            return self.projectPackedAt(packed, times, shares)
+        for name, wireframe in self.wireframes.iteritems():
+            nodes = self.scene.worldNodesAt(name, times)
+            points, in_front = self.projectNodes(nodes)
+            if self.culling or any(shares):
+                for i in xrange(len(times)):
+                    level = self.drawnLevel(wireframe, shares[i].get(name))
+                    drawn, culled = self.projectLevel(level, nodes[i], points[i], in_front[i])
+                    self.block_culled_edges[i] += culled
+                    frames[i].append(drawn)
+                continue
+            edges = np.asarray(wireframe.edges, dtype=np.intp).reshape(-1, 2)
+            segments = points[:, edges]
+            keep = in_front[:, edges[:, 0]] & in_front[:, edges[:, 1]]
+            for i in xrange(len(times)):
+                frames[i].append(segments[i][keep[i]])
+        return [np.concatenate(frame) if frame else np.zeros((0, 2, 2)) for frame in frames]
+
+    def packedLevels(self, packed, nodes, points, in_front, shares):
+        """ Line segments for each wireframe of a PackedScene, culled and at its level of detail, from the world
+            nodes and projection of the whole scene. Returns the segments and how many edges were culled. """
+        segments = []
+        culled_edges = 0
+        for i, (name, wireframe) in enumerate(zip(packed.names, packed.wireframes)):
+            rows = slice(packed.node_starts[i], packed.node_starts[i+1])
+            level = self.drawnLevel(wireframe, shares.get(name))
+            drawn, culled = self.projectLevel(level, nodes[rows], points[rows], in_front[rows])
+            culled_edges += culled
+            segments.append(drawn)
+        return (np.concatenate(segments) if segments else np.zeros((0, 2, 2))), culled_edges
+
+    def projectPacked(self, packed, shares):
+        """project for a packed scene: the world nodes of every wireframe are found and projected in one go,
+        and without culling or LOD all of the edges are gathered at once too."""
+        nodes = self.scene.packedWorldNodes(packed)
+        points, in_front = self.projectNodes(nodes)
+        if self.culling or shares:
+            segments, self.culled_edges = self.packedLevels(packed, nodes, points, in_front, shares)
+            return segments
+        edges = packed.edges
+        return points[edges[in_front[edges[:, 0]] & in_front[edges[:, 1]]]]
+
+    def projectPackedAt(self, packed, times, shares):
+        """projectAt for a packed scene."""
+        nodes = self.scene.packedWorldNodesAt(packed, times)
+        points, in_front = self.projectNodes(nodes)
+        if self.culling or any(shares):
+            frames = []
+            for i in xrange(len(times)):
+                segments, self.block_culled_edges[i] = self.packedLevels(packed, nodes[i], points[i], in_front[i],
+                                                                         shares[i])
+                frames.append(segments)
+            return frames
+        edges = packed.edges
+        segments = points[:, edges]
+        keep = in_front[:, edges[:, 0]] & in_front[:, edges[:, 1]]
+        return [segments[i][keep[i]] for i in xrange(len(times))]
+
+    def frameVectors(self):
+        """The current frame's line segments as a list of ((x1, y1), (x2, y2)) tuples."""
+        return [(tuple(a), tuple(b)) for a, b in self.frame_edges.tolist()]
+
     def display(self):
-        self.frame_vectors = []
+        self.frame_edges = self.project()
 
         if self.show_view:
             self.screen.fill(self.background)
-        
-        for name, wireframe in self.wireframes.iteritems():
-            nodes = wireframe.nodes
-
-            for (n1, n2) in wireframe.edges:
-                if self.perspective:
-                    if wireframe.nodes[n1][2] > -self.perspective and nodes[n2][2] > -self.perspective:
-                        z1 = self.perspective/ (self.perspective + nodes[n1][2])
-                        x1 = self.width/2  + z1*(nodes[n1][0] - self.width/2)
-                        y1 = self.height/2 + z1*(nodes[n1][1] - self.height/2)
-
-                        z2 = self.perspective/ (self.perspective + nodes[n2][2])
-                        x2 = self.width/2  + z2*(nodes[n2][0] - self.width/2)
-                        y2 = self.height/2 + z2*(nodes[n2][1] - self.height/2)
-
-                        self.frame_vectors.append(((x1, y1), (x2, y2)))
-                        if self.show_view:
-                            pygame.draw.line(self.screen, self.nodeColour, (x1, y1), (x2, y2), self.line_width)
-                else:
-                    self.frame_vectors.append(((nodes[n1][0], nodes[n1][1]), (nodes[n2][0], nodes[n2][1])))
-                    if self.show_view:
-                        pygame.draw.line(self.screen, self.nodeColour, (nodes[n1][0], nodes[n1][1]), (nodes[n2][0], nodes[n2][1]), self.line_width)
-
-        if self.show_view:
+            for start, end in self.frame_edges.tolist():
+                pygame.draw.line(self.screen, self.nodeColour, start, end, self.line_width)
             pygame.display.flip()
 
     def keyEvent(self, key):
@@ -190,9 +343,59 @@ class WireframeViewer(wf.WireframeGroup):
             self.running = False
             return
 
+    def object_update(self, _, dt):
+        """Replace this function to move the wireframes each frame."""
+        pass
+
+    def advance(self, dt):
+        """Move the scene, the effects and the clocks on by one frame."""
+        profiler = self.profiler
+        if profiler:
+            start = profiler.clock()
+        self.elapsed += dt
+        self.object_update(self, dt)
+        if profiler:
+            start = profiler.add("object_update", start)
+        self.scene.setTime(self.elapsed)
+        if profiler:
+            start = profiler.add("scene", start)
+        self.frame_update(self, dt)
+        if profiler:
+            start = profiler.add("frame_update", start)
+        for effect in self.effects:
+            effect.update(self, dt)
+        if profiler:
+            profiler.add("effects", start)
+        self.frame += 1
+
+    def renderFrame(self):
+        """Display, export and advance one frame, timing each phase if profiling is on."""
+        profiler = self.profiler
+        if not profiler:
+            self.display()
+            self.audio_update(self)
+            self.advance(self.getdelta())
+            return
+        profiler.beginFrame(self.frame)
+        start = profiler.clock()
+        self.display()
+        start = profiler.add("display", start)
+        profiler.count("edges_projected", len(self.frame_edges))
+        profiler.count("edges_culled", self.culled_edges)
+        self.audio_update(self)
+        profiler.add("audio_update", start)
+        self.advance(self.getdelta())
+
+    def enableProfiling(self, profiler=None):
+        """Time and count the work done each frame, here and in the WavOutput. Returns the profiler.Profiler used."""
+        self.profiler = profiler if profiler is not None else prof.Profiler()
+        if self.wavout:
+            self.wavout.profiler = self.profiler
+        return self.profiler
+
     def audio_update(self, _):
         if self.wavout:
-            self.wavout.wavify(self.frame_vectors, self.width)
+            self.wavout.wavify(self.frame_edges, self.width)
 
     def lazycount(self):
         """Run nothing but the frame counter, then reset."""
@@ -221,7 +424,7 @@ class WireframeViewer(wf.WireframeGroup):
 
 
     def fast_forward(self, frames):  # somewhat hacky
-        """Run the main loop, without export, for a certain number of frames."""
+        """Run the main loop, without export or projection, for a certain number of frames."""
         print "Fast-forwarding " + str(frames) + " frames..."
         real_stdout = sys.stdout
         sys.stdout = open(os.devnull,"w")
@@ -233,43 +436,141 @@ class WireframeViewer(wf.WireframeGroup):
         tmp = self.show_view
         self.show_view = False
         for i in xrange(frames):
-            #if i % 10 == 9:
-            #    print str(i + 1) + "/" + str(frames)
-            self.display()
-            dt = self.getdelta()
-            self.object_update(self, dt)
-            for effect in self.effects:
-                effect.update(self, dt)
+            self.advance(self.getdelta())
         self.running = False
         self.show_view = tmp
         sys.stdout = real_stdout
 
-    def record(self, frames, view=False):  # somewhat hacky
-        """Run the main loop, with export, for a certain number of frames."""
+    def snapshot(self):
+        """Capture everything that changes from frame to frame, so it can be restored later."""
+        return {
+            "frame": self.frame,
+            "elapsed": self.elapsed,
+            "has_run": self.has_run,
+            "nodes": dict((name, wireframe.nodes.copy()) for name, wireframe in self.wireframes.iteritems()),
+            "scene": self.scene.state(),
+            "effects": [copy.deepcopy(effect.__dict__) for effect in self.effects],
+            "fps": self.fps,
+            "fixed_dt": self.fixed_dt,
+            "time_left": self.time_left,
+            "total_time": self.total_time,
+            "last_percent": self.last_percent,
+        }
+
+    def restore(self, snapshot):
+        """Return to the state captured by snapshot(). The same wireframes and effects must be set up."""
+        self.frame = snapshot["frame"]
+        self.elapsed = snapshot["elapsed"]
+        self.has_run = snapshot["has_run"]
+        for name, nodes in snapshot["nodes"].iteritems():
+            self.wireframes[name].nodes = nodes.copy()
+        self.scene.setState(snapshot["scene"])
+        self.scene.setTime(self.elapsed)
+        for effect, state in zip(self.effects, snapshot["effects"]):
+            effect.__dict__.update(copy.deepcopy(state))
+        self.fps = snapshot["fps"]
+        self.fixed_dt = snapshot["fixed_dt"]
+        if self.wavout and self.fps:
+            self.wavout.setfps(self.fps)
+        self.time_left = snapshot["time_left"]
+        self.total_time = snapshot["total_time"]
+        self.last_percent = snapshot["last_percent"]
+
+    def plan_checkpoints(self, interval=100):
+        """Run the whole animation without projection or export, taking a snapshot every interval frames.
+
+        Returns the list of snapshots; the frame count of the animation is left in self.frame."""
+        print "Planning checkpoints every " + str(interval) + " frames..."
+        real_stdout = sys.stdout
+        sys.stdout = open(os.devnull,"w")
+        if not self.has_run:
+            for effect in self.effects:
+                effect.create(self)
+        self.has_run = True
+        self.running = True
+        checkpoints = []
+        while self.running:
+            if self.frame % interval == 0:
+                checkpoints.append(self.snapshot())
+            self.advance(self.getdelta())
+        self.running = False
+        sys.stdout = real_stdout
+        return checkpoints
+
+    def seek(self, frame, checkpoints):
+        """Jump to a frame by restoring the nearest earlier checkpoint and fast-forwarding the rest of the way."""
+        index = bisect.bisect_right([checkpoint["frame"] for checkpoint in checkpoints], frame) - 1
+        if index >= 0 and (self.frame > frame or checkpoints[index]["frame"] > self.frame):
+            self.restore(checkpoints[index])
+        if self.frame > frame:
+            raise Exception("Cannot seek backwards to frame " + str(frame) + " without an earlier checkpoint.")
+        self.fast_forward(frame - self.frame)
+
+    def record(self, frames, view=False, finish=True, block_size=None):  # somewhat hacky
+        """Run the main loop, with export, for a certain number of frames.
+
+        With finish=False the output is left open so that recording can carry on later.
+        With a block_size, frames are projected that many at a time (see record_blocks)."""
         print "Recording " + str(frames) + " frames..."
         if not self.has_run:
             for effect in self.effects:
                 effect.create(self)
         self.has_run = True
         self.running = True
+        if block_size:
+            self.record_blocks(frames, block_size)
+            frames = 0
         tmp = self.show_view
         self.show_view = view
         for i in xrange(frames):
             if i % 10 == 9:
                 print str(i + 1) + "/" + str(frames)
-            self.display()
-            dt = self.getdelta()
-            self.object_update(self, dt)
-            self.audio_update(self)
-            self.frame_update(self, dt)
-            for effect in self.effects:
-                effect.update(self, dt)
+            self.renderFrame()
         self.running = False
         self.show_view = tmp
 
-        if self.wavout:
+        if self.wavout and finish:
             self.wavout.buffer_wav(None)  # flush buffer
 
+    def record_blocks(self, frames, block_size):
+        """Record frames in blocks: step the effects and clocks through a block, then project all of its frames at once.
+
+        Only valid when everything moves by scene graph trajectories rather than object_update."""
+        profiler = self.profiler
+        for start in xrange(0, frames, block_size):
+            count = min(block_size, frames - start)
+            times = []
+            budgets = []
+            records = []
+            for i in xrange(count):
+                if profiler:
+                    records.append(profiler.beginFrame(self.frame))
+                times.append(self.elapsed)
+                budgets.append(self.wavout.samples_per_frame if self.wavout else None)
+                self.advance(self.getdelta())
+            print str(start + count) + "/" + str(frames)
+            if not self.wavout:
+                continue
+            current = self.wavout.samples_per_frame
+            if profiler:
+                clock = profiler.clock()
+            blocks = self.projectAt(times, budgets)
+            if profiler:
+                profiler.share("display", clock, records)
+            for i, (frame_edges, budget, culled) in enumerate(zip(blocks, budgets, self.block_culled_edges)):
+                self.frame_edges = frame_edges
+                self.culled_edges = culled
+                self.wavout.samples_per_frame = budget
+                if profiler:
+                    profiler.resumeFrame(records[i])
+                    profiler.count("edges_projected", len(frame_edges))
+                    profiler.count("edges_culled", culled)
+                    clock = profiler.clock()
+                self.audio_update(self)
+                if profiler:
+                    profiler.add("audio_update", clock)
+            self.wavout.samples_per_frame = current
+
     def run(self):
         """Display wireframe on screen and respond to keydown events"""
         if not self.has_run:
@@ -291,13 +592,7 @@ class WireframeViewer(wf.WireframeGroup):
                         key_down = None
                 if key_down:
                     self.keyEvent(key_down)
-            self.display()
-            dt = self.getdelta()
-            self.object_update(self, dt)
-            self.audio_update(self)
-            self.frame_update(self, dt)
-            for effect in self.effects:
-                effect.update(self, dt)
+            self.renderFrame()
 
         if self.show_view:
             pygame.quit()